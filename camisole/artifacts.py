@@ -0,0 +1,111 @@
+import contextlib
+import fcntl
+import functools
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import List, Tuple
+
+from camisole.conf import conf
+from camisole.store import DiskStore
+
+# where artifacts are mounted in the execution boxes
+MOUNT_POINT = '/artifact'
+
+# ioctl(2) sharing the extents of a file with another one (reflink), see
+# ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst) -> None:
+    """
+    Copy a file without going through user space: reflink it if the
+    filesystem supports it, or let the kernel copy it with copy_file_range(2).
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+
+        try:
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+                pass
+            return
+        except OSError:
+            # eg. across filesystems on older kernels
+            pass
+
+    shutil.copyfile(src, dst)
+
+
+class Artifact:
+    """
+    Handle to the files produced by a compilation, kept in the artifact
+    store. Handles are cheap to copy and pickle, the files themselves are
+    never loaded in memory.
+    """
+
+    def __init__(self, key: str, names: List[str]):
+        self.key = key
+        self.names = names
+
+    def __repr__(self):
+        return f"<Artifact {self.key} {self.names}>"
+
+    def __eq__(self, other):
+        return isinstance(other, Artifact) and \
+            (self.key, self.names) == (other.key, other.names)
+
+    @property
+    def path(self) -> Path:
+        return artifact_store().path(self.key)
+
+    def exists(self) -> bool:
+        return self.key in artifact_store()
+
+    def files(self) -> List[Tuple[str, Path]]:
+        return [(name, self.path / name) for name in self.names]
+
+
+class ArtifactStore(DiskStore):
+    """
+    :class:`DiskStore` of compiled files, one directory per compilation.
+    Artifacts in use are pinned so that they are not evicted.
+    """
+
+    def put_files(self, files: List[Tuple[str, Path]]) -> Artifact:
+        tmp = self.mkdtemp()
+
+        try:
+            for name, path in files:
+                clone_file(path, tmp / name)
+                (tmp / name).chmod(0o755)
+            # readable by the box users when mounted
+            tmp.chmod(0o755)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        key = uuid.uuid4().hex
+        self.put_path(key, tmp)
+        return Artifact(key, [name for name, _ in files])
+
+
+@contextlib.contextmanager
+def pinned(binary):
+    """Keep an artifact from being evicted; anything else is ignored."""
+    if not isinstance(binary, Artifact):
+        yield
+        return
+
+    with artifact_store().pinned(binary.key):
+        yield
+
+
+@functools.lru_cache()
+def artifact_store() -> ArtifactStore:
+    return ArtifactStore(Path(conf['cache-dir']).expanduser() / 'artifacts',
+                         conf['artifact-store']['size'])
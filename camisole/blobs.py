@@ -0,0 +1,96 @@
+import functools
+import hashlib
+import re
+import shutil
+from pathlib import Path
+from typing import AsyncIterable, Optional
+
+from camisole.conf import conf
+from camisole.store import DiskStore
+
+# where a blob is mounted in the boxes, and its name there
+MOUNT_POINT = '/input'
+FILENAME = 'blob'
+
+RE_KEY = re.compile(r'[0-9a-f]{64}')
+
+
+class BlobError(ValueError):
+    pass
+
+
+class BlobTooLarge(BlobError):
+    pass
+
+
+class BlobStore(DiskStore):
+    """
+    Content-addressed :class:`DiskStore`, used for the test inputs.
+
+    Each blob is a directory, named after the SHA-256 of the blob, holding a
+    single file. Mounting that directory in a box gives access to the blob
+    and nothing else.
+    """
+
+    def blob_path(self, key: str) -> Optional[Path]:
+        path = self.get(key)
+        return path / FILENAME if path is not None else None
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+
+        if self.get(key) is None:
+            tmp = self.mkdtemp()
+            (tmp / FILENAME).write_bytes(data)
+            self.put_path(key, self.seal(tmp))
+
+        return key
+
+    async def put_stream(self, key: str,
+                         chunks: AsyncIterable[bytes]) -> bool:
+        """
+        Store a blob received in chunks, checking it matches its SHA-256
+        ``key``. Return whether the blob was new.
+        """
+        if self.get(key) is not None:
+            return False
+
+        tmp = self.mkdtemp()
+        sha256 = hashlib.sha256()
+        size = 0
+
+        try:
+            with (tmp / FILENAME).open('wb') as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise BlobTooLarge(
+                            f"blob larger than the store ({self.max_size} "
+                            f"bytes)")
+                    sha256.update(chunk)
+                    f.write(chunk)
+
+            if sha256.hexdigest() != key:
+                raise BlobError(
+                    f"SHA-256 of the blob is {sha256.hexdigest()}, not {key}")
+
+            # someone else may have sent it in the meantime
+            if self.get(key) is None:
+                self.put_path(key, self.seal(tmp))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        return True
+
+    @staticmethod
+    def seal(path: Path) -> Path:
+        # readable by the box users
+        (path / FILENAME).chmod(0o644)
+        path.chmod(0o755)
+        return path
+
+
+@functools.lru_cache()
+def blob_store() -> BlobStore:
+    return BlobStore(Path(conf['cache-dir']).expanduser() / 'blobs',
+                     conf['blob-store']['size'])
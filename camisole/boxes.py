@@ -0,0 +1,394 @@
+import asyncio
+import collections
+import fcntl
+import logging
+import os
+import pathlib
+import time
+from typing import Optional
+
+import camisole.isolate
+
+logger = logging.getLogger(__name__)
+
+
+class NoBoxAvailable(RuntimeError):
+    def __init__(self, message="No isolate box ID available."):
+        super().__init__(message)
+
+
+class BoxQueueFull(NoBoxAvailable):
+    def __init__(self, message="Too many requests waiting for an isolate box."):
+        super().__init__(message)
+
+
+class BoxLocks:
+    """
+    One lock file per box ID, locked with flock(2) by the process using the
+    box, so that several camisole processes can share the isolate boxes. The
+    kernel releases the locks of a process when it dies.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # box ID -> file descriptor holding the lock
+        self.held: dict[int, int] = {}
+
+    def __repr__(self):
+        return f"<BoxLocks {self.directory} {len(self.held)} held>"
+
+    def try_lock(self, box_id: int) -> bool:
+        fd = os.open(self.directory / str(box_id),
+                     os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        self.held[box_id] = fd
+        return True
+
+    def unlock(self, box_id: int) -> None:
+        fd = self.held.pop(box_id, None)
+        if fd is not None:
+            # releases the lock
+            os.close(fd)
+
+
+class BoxPool:
+    """
+    In-process allocator of isolate box IDs.
+
+    The free list is seeded once with every box ID isolate manages
+    (``num_boxes`` in the isolate configuration), so that acquiring and
+    releasing a box never requires scanning ``box_root``. As all the
+    bookkeeping happens on the event loop thread, two concurrent requests can
+    never be handed the same box ID.
+
+    When every box is busy, callers wait in a FIFO queue of at most
+    ``max_waiters`` entries (unbounded if ``None``) for at most ``timeout``
+    seconds (forever if ``None``). Released boxes are handed directly to the
+    oldest waiter.
+
+    Boxes found already initialized by someone else are marked stale and kept
+    out of the free list for ``stale_delay`` seconds, so that they do not cost
+    a failed ``isolate --init`` on every acquisition.
+
+    With ``locks``, the boxes are shared with other processes: a box is only
+    handed out once its lock is taken, and held until it is back in the free
+    list. As the other processes can't wake up our waiters, boxes are polled
+    every ``poll_interval`` seconds while there are waiters.
+    """
+
+    def __init__(self, size: int, max_waiters: Optional[int] = None,
+                 timeout: Optional[float] = None, stale_delay: float = 60,
+                 locks: Optional[BoxLocks] = None,
+                 poll_interval: float = .05):
+        self.size = size
+        self.max_waiters = max_waiters
+        self.timeout = timeout
+        self.stale_delay = stale_delay
+        self.locks = locks
+        self.poll_interval = poll_interval
+        self.poller: Optional[asyncio.Task] = None
+        self.free = collections.deque(range(size))
+        self.busy: set[int] = set()
+        # (time at which the box can be retried, box ID), oldest first
+        self.stale: collections.deque[tuple[float, int]] = collections.deque()
+        self.waiters: collections.deque[asyncio.Future] = collections.deque()
+
+    def __repr__(self):
+        return (f"<BoxPool {len(self.busy)}/{self.size} busy, "
+                f"{len(self.stale)} stale, {len(self.waiters)} waiting>")
+
+    def try_acquire(self) -> Optional[int]:
+        self._revive()
+
+        for _ in range(len(self.free)):
+            box_id = self.free.popleft()
+
+            if self.locks is None or self.locks.try_lock(box_id):
+                self.busy.add(box_id)
+                return box_id
+
+            # used by another process
+            self.free.append(box_id)
+
+        return None
+
+    async def acquire(self) -> int:
+        box_id = self.try_acquire()
+        if box_id is not None:
+            return box_id
+
+        if self.max_waiters is not None and \
+                len(self.waiters) >= self.max_waiters:
+            raise BoxQueueFull()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+
+        if self.locks is not None and \
+                (self.poller is None or self.poller.done()):
+            self.poller = asyncio.ensure_future(self._poll())
+
+        try:
+            await asyncio.wait((waiter,), timeout=self.timeout)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+        if not waiter.done():
+            self._abandon(waiter)
+            raise NoBoxAvailable(
+                f"Timed out after {self.timeout}s waiting for an isolate box.")
+
+        return waiter.result()
+
+    def release(self, box_id: int) -> None:
+        if box_id not in self.busy:
+            return
+
+        self.busy.remove(box_id)
+        self._dispatch(box_id)
+        self._revive()
+
+    def mark_stale(self, box_id: int) -> None:
+        if box_id not in self.busy:
+            return
+
+        self.busy.remove(box_id)
+        self.stale.append((time.monotonic() + self.stale_delay, box_id))
+
+    def _revive(self) -> None:
+        now = time.monotonic()
+
+        while self.stale and self.stale[0][0] <= now:
+            _, box_id = self.stale.popleft()
+            self._dispatch(box_id)
+
+    def _dispatch(self, box_id: int) -> None:
+        # hand the box over to the oldest waiter still interested, if any
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.busy.add(box_id)
+                waiter.set_result(box_id)
+                return
+
+        if self.locks is not None:
+            self.locks.unlock(box_id)
+        self.free.append(box_id)
+
+    async def _poll(self) -> None:
+        # look for boxes released by the other processes
+        while self.waiters:
+            await asyncio.sleep(self.poll_interval)
+
+            while self.waiters:
+                box_id = self.try_acquire()
+                if box_id is None:
+                    break
+                self.busy.remove(box_id)
+                self._dispatch(box_id)
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # a box was handed over right before we gave up waiting
+            self.release(waiter.result())
+            return
+
+        waiter.cancel()
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+def box_command(box_id: int) -> list[str]:
+    return ['isolate', '--box-id', str(box_id), '--cg']
+
+
+class WarmBoxPool:
+    """
+    Hands out initialized isolate boxes, taking their IDs from a
+    :class:`BoxPool`.
+
+    Up to ``size`` boxes are kept initialized ahead of demand. Boxes given
+    back are cleaned up and initialized again in the background, so that a
+    sandbox only pays for the actual ``isolate --run``. With ``size`` set to
+    0, boxes are initialized on acquisition and cleaned up on release.
+    """
+
+    def __init__(self, pool: BoxPool, size: int = 0):
+        self.pool = pool
+        self.size = size
+        # initialized boxes, as (box ID, box root directory)
+        self.ready: collections.deque[tuple[int, pathlib.Path]] = \
+            collections.deque()
+        self.warming = 0
+        self.tasks: set[asyncio.Task] = set()
+
+    def __repr__(self):
+        return (f"<WarmBoxPool {len(self.ready)}/{self.size} ready, "
+                f"{self.warming} warming, {self.pool!r}>")
+
+    async def acquire(self) -> tuple[int, pathlib.Path]:
+        if self.ready:
+            box = self.ready.popleft()
+            self.fill()
+            return box
+
+        while True:
+            box_id = await self.pool.acquire()
+            root = await self.init(box_id)
+            if root is not None:
+                self.fill()
+                return box_id, root
+
+    async def release(self, box_id: int) -> None:
+        if not self.size:
+            await self.cleanup(box_id)
+            self.pool.release(box_id)
+            return
+
+        self.spawn(self.recycle(box_id))
+
+    def fill(self) -> None:
+        """Start warming boxes until ``size`` of them are ready."""
+        while len(self.ready) + self.warming < self.size:
+            box_id = self.pool.try_acquire()
+            if box_id is None:
+                return
+            self.warming += 1
+            self.spawn(self.warm(box_id))
+
+    async def warm_up(self) -> None:
+        self.fill()
+        await self.join()
+
+    async def join(self) -> None:
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+    async def drain(self) -> None:
+        """Clean up every box kept ready, eg. when shutting down."""
+        await self.join()
+        while self.ready:
+            box_id, _ = self.ready.popleft()
+            try:
+                await self.cleanup(box_id)
+            except RuntimeError:
+                logger.exception("could not clean up box %d", box_id)
+            else:
+                self.pool.release(box_id)
+
+    async def init(self, box_id: int) -> Optional[pathlib.Path]:
+        """
+        Initialize a box, returning its root directory, or None if the box was
+        already initialized by someone else.
+        """
+        cmd_init = box_command(box_id) + ['--init']
+        init = asyncio.ensure_future(camisole.isolate.communicate(cmd_init))
+
+        try:
+            retcode, stdout, stderr = await asyncio.shield(init)
+        except asyncio.CancelledError:
+            # killing isolate halfway through the init would leave the box in
+            # an unknown state, so let it finish and clean up afterwards
+            self.spawn(self.abort_init(box_id, init))
+            raise
+        except BaseException:
+            self.pool.release(box_id)
+            raise
+
+        if retcode == 2 and b"already exists" in stderr:
+            # initialized by someone else (eg. a stale box left by a
+            # previous camisole process), don't retry it right away
+            self.pool.mark_stale(box_id)
+            return None
+
+        if retcode != 0:  # noqa
+            self.pool.release(box_id)
+            raise RuntimeError(
+                "{} returned code {}: “{}”"
+                .format(cmd_init, retcode, stderr)
+            )
+
+        return pathlib.Path(stdout.strip().decode())
+
+    async def abort_init(self, box_id: int, init: asyncio.Future) -> None:
+        try:
+            retcode, _, _ = await init
+        except BaseException:
+            self.pool.release(box_id)
+            raise
+
+        if retcode == 0:
+            await self.cleanup_and_release(box_id)
+        else:
+            self.pool.release(box_id)
+
+    async def cleanup(self, box_id: int) -> None:
+        cmd_cleanup = box_command(box_id) + ['--cleanup']
+
+        try:
+            retcode, stdout, stderr = \
+                await camisole.isolate.communicate(cmd_cleanup)
+        except BaseException:
+            self.pool.mark_stale(box_id)
+            raise
+
+        if retcode != 0:  # noqa
+            self.pool.mark_stale(box_id)
+            raise RuntimeError(
+                "{} returned code {}: “{}”"
+                .format(cmd_cleanup, retcode, stderr)
+            )
+
+    async def warm(self, box_id: int) -> None:
+        try:
+            root = await self.init(box_id)
+        finally:
+            self.warming -= 1
+
+        if root is not None:
+            self.offer(box_id, root)
+
+    async def recycle(self, box_id: int) -> None:
+        await self.cleanup(box_id)
+
+        # sandboxes waiting for a box ID initialize it themselves
+        if self.pool.waiters or len(self.ready) + self.warming >= self.size:
+            self.pool.release(box_id)
+            return
+
+        self.warming += 1
+        await self.warm(box_id)
+
+    def offer(self, box_id: int, root: pathlib.Path) -> None:
+        if not self.pool.waiters:
+            self.ready.append((box_id, root))
+            return
+
+        # give precedence to sandboxes already waiting for a box ID
+        self.spawn(self.cleanup_and_release(box_id))
+
+    async def cleanup_and_release(self, box_id: int) -> None:
+        await self.cleanup(box_id)
+        self.pool.release(box_id)
+
+    def spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("background box maintenance failed",
+                         exc_info=task.exception())
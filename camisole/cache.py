@@ -0,0 +1,165 @@
+import asyncio
+import collections
+import copy
+import functools
+import hashlib
+import json
+import logging
+import pickle
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from camisole.conf import conf
+from camisole.store import DiskStore
+
+logger = logging.getLogger(__name__)
+
+
+def digest(*parts) -> str:
+    """SHA-256 of JSON-serializable parts, bytes being hashed separately."""
+    h = hashlib.sha256()
+
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(b'b%d:' % len(part))
+            h.update(part)
+        else:
+            data = json.dumps(part, sort_keys=True, default=repr).encode()
+            h.update(b'j%d:' % len(data))
+            h.update(data)
+
+    return h.hexdigest()
+
+
+class CompileCache:
+    """
+    Two-tier cache of compilation results: an in-memory LRU tier of at most
+    ``memory_size`` bytes, backed by an optional on-disk tier of at most
+    ``disk_size`` bytes.
+
+    Values are stored pickled, so that every hit gets its own copy.
+    """
+
+    def __init__(self, memory_size: int, disk_root: Optional[Path] = None,
+                 disk_size: int = 0):
+        self.memory_size = memory_size
+        self.memory: collections.OrderedDict[str, bytes] = \
+            collections.OrderedDict()
+        self.memory_used = 0
+        self.disk = DiskStore(disk_root, disk_size) \
+            if disk_root is not None and disk_size else None
+
+    def __repr__(self):
+        return (f"<CompileCache {len(self.memory)} entries, "
+                f"{self.memory_used}/{self.memory_size} bytes, {self.disk!r}>")
+
+    def get(self, key: str) -> Optional[Any]:
+        data = self.memory.get(key)
+
+        if data is not None:
+            self.memory.move_to_end(key)
+        elif self.disk is not None:
+            path = self.disk.get(key)
+            if path is None:
+                return None
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:
+                return None
+            self._remember(key, data)
+        else:
+            return None
+
+        try:
+            return pickle.loads(data)
+        except Exception:
+            logger.exception("corrupted compile cache entry %s", key)
+            self.discard(key)
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, data)
+
+        if self.disk is not None:
+            self.disk.put_bytes(key, data)
+
+    def discard(self, key: str) -> None:
+        data = self.memory.pop(key, None)
+        if data is not None:
+            self.memory_used -= len(data)
+
+        if self.disk is not None:
+            self.disk.discard(key)
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_size:
+            return
+
+        old = self.memory.pop(key, None)
+        if old is not None:
+            self.memory_used -= len(old)
+
+        self.memory[key] = data
+        self.memory_used += len(data)
+
+        while self.memory_used > self.memory_size:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls: while a call for a given key is in flight,
+    later calls for the same key wait for it and get a copy of its result
+    instead of starting their own.
+    """
+
+    def __init__(self):
+        self.inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        while key in self.inflight:
+            future = self.inflight[key]
+            try:
+                # don't let a cancelled follower cancel the leader
+                return copy.deepcopy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the leader was cancelled, take over
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+
+        try:
+            result = await func()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # followers retrieve it; don't warn if there are none
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return copy.deepcopy(result)
+        finally:
+            del self.inflight[key]
+
+
+compilations = SingleFlight()
+
+
+@functools.lru_cache()
+def compile_cache() -> Optional[CompileCache]:
+    settings = conf['compile-cache']
+
+    if not settings.get('enabled'):
+        return None
+
+    return CompileCache(
+        settings['memory-size'],
+        disk_root=Path(conf['cache-dir']).expanduser() / 'compile',
+        disk_size=settings.get('disk-size', 0))
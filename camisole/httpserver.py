@@ -1,88 +1,249 @@
 import aiohttp.web
+import asyncio
+import base64
+import contextlib
+import copy
 import functools
 import json
+import logging
 import msgpack
+import os
+import pathlib
 import traceback
 
+try:
+    import orjson
+except ImportError:  # optional, faster JSON encoding and decoding
+    orjson = None
+
+from camisole.conf import conf
 from camisole.utils import AcceptHeader
+import camisole.blobs
+import camisole.boxes
+import camisole.cache
+import camisole.isolate
+import camisole.jobs
+import camisole.judge
 import camisole.languages
 import camisole.ref
 import camisole.schema
 import camisole.system
+import camisole.versions
+import camisole.workers
 
 TYPE_JSON = 'application/json'
 TYPE_MSGPACK = 'application/msgpack'
+TYPE_NDJSON = 'application/x-ndjson'
+TYPE_SSE = 'text/event-stream'
 CONTENT_TYPES = (TYPE_JSON, TYPE_MSGPACK)
+STREAM_TYPES = (TYPE_NDJSON, TYPE_SSE)
+
+
+def get_accepted_types(request, available=CONTENT_TYPES):
+    return list(
+        AcceptHeader.get_best_accepted_types(
+            request.headers.getone('accept', '*/*'), available
+        )
+    )
+
+
+class BinaryPayload(ValueError):
+    """The payload has bytes that can't be represented in JSON."""
+
+
+def to_json_compatible(obj, base64_bytes=False):
+    """
+    Copy of ``obj`` where bytes are decoded as UTF-8 or, if they are not
+    UTF-8 and ``base64_bytes`` is set, replaced by ``{"base64": <data>}``.
+    Raise :class:`BinaryPayload` as soon as bytes can't be represented.
+    """
+    if isinstance(obj, dict):
+        return {k: to_json_compatible(v, base64_bytes)
+                for k, v in obj.items()}
+
+    if isinstance(obj, (list, tuple)):
+        return [to_json_compatible(v, base64_bytes) for v in obj]
+
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        try:
+            return str(obj, 'utf-8')
+        except UnicodeDecodeError:
+            if not base64_bytes:
+                raise BinaryPayload() from None
+            return {'base64': base64.b64encode(obj).decode('ascii')}
 
+    return obj
 
-class BinaryJsonEncoder(json.JSONEncoder):
-    """Best-effort :class:`JSONEncoder` that tries to decode bytes."""
 
-    def default(self, o):
-        if isinstance(o, bytes):
+def dumps_json(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+    return json.dumps(obj, sort_keys=True).encode()
+
+
+def loads_json(data):
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data.decode())
+
+
+def dumps_msgpack(obj):
+    return msgpack.dumps(obj, use_bin_type=True)
+
+
+def encode(payload, accepted_types, base64_bytes=False):
+    """
+    Encode the payload in the first accepted content type able to represent
+    it, and return both. Bytes are only looked at once: JSON is given up at
+    the first bytes that are not UTF-8, without encoding anything.
+    """
+    for content_type in accepted_types:
+        if content_type == TYPE_MSGPACK:
+            return content_type, dumps_msgpack(payload)
+
+        if content_type == TYPE_JSON:
             try:
-                return o.decode()
+                payload_json = to_json_compatible(payload, base64_bytes)
+            except BinaryPayload:
+                continue
+            return content_type, dumps_json(payload_json)
+
+    raise BinaryPayload()
+
+
+class CachedPayload:
+    """
+    Payload not changing while the server runs, encoded once per set of
+    accepted types and served with an ETag, so that clients polling it can
+    get a 304 Not Modified.
+    """
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.etag = camisole.cache.digest(payload)
+        self.encoded = {}
+
+    def response(self, request):
+        headers = {'ETag': f'"{self.etag}"', 'Cache-Control': 'no-cache'}
+
+        if any(tag.value in (self.etag, '*')
+               for tag in request.if_none_match or ()):
+            return aiohttp.web.Response(
+                status=aiohttp.web.HTTPNotModified.status_code,
+                headers=headers)
+
+        accepted_types = tuple(get_accepted_types(request))
+        if accepted_types not in self.encoded:
+            try:
+                self.encoded[accepted_types] = encode(
+                    self.payload, accepted_types)
+            except BinaryPayload:
+                return aiohttp.web.Response(
+                    status=aiohttp.web.HTTPNotAcceptable.status_code)
+
+        content_type, data = self.encoded[accepted_types]
+        return aiohttp.web.Response(body=data, content_type=content_type,
+                                    headers=headers)
+
+
+def wants_base64(request):
+    return request.query.get('binary') == 'base64'
+
+
+def binary_payload_error():
+    # explain how to work around the issue
+    return (f"use 'Accept: {TYPE_MSGPACK}' or '?binary=base64' to be able "
+            f"to receive binary payloads")
+
+
+def get_stream_type(request):
+    """
+    Content type of the streamed response asked for, either explicitly in
+    the Accept header or with the ``stream`` query flag; None if the response
+    is not to be streamed.
+    """
+    # streams only match explicitly accepted types, not wildcards
+    best = next(iter(get_accepted_types(
+        request, CONTENT_TYPES + STREAM_TYPES)), None)
+
+    if best in STREAM_TYPES:
+        return best
+
+    if request.query.get('stream', '0') not in ('', '0', 'false'):
+        return TYPE_MSGPACK if best == TYPE_MSGPACK else TYPE_NDJSON
+
+    return None
+
+
+def encode_stream_item(content_type, item, base64_bytes=False):
+    """
+    One item of a streamed response: a line of JSON, a server-sent event
+    named after the ``event`` of the item, or a MessagePack object.
+    """
+    if content_type == TYPE_MSGPACK:
+        return dumps_msgpack(item)
 
-            except UnicodeDecodeError:
-                raise TypeError() from None
+    try:
+        data = dumps_json(to_json_compatible(item, base64_bytes))
+    except BinaryPayload:
+        data = dumps_json({
+            **{k: item[k] for k in ('event', 'index') if k in item},
+            'success': False,
+            'error': binary_payload_error(),
+        })
+
+    if content_type == TYPE_SSE:
+        return b'event: %s\ndata: %s\n\n' % (
+            item.get('event', 'message').encode(), data)
+
+    return data + b'\n'
 
-        return super().default(o)
+
+async def stream_response(request, content_type):
+    response = aiohttp.web.StreamResponse(headers={
+        'Content-Type': content_type,
+        'Cache-Control': 'no-cache',
+    })
+    await response.prepare(request)
+    return response
 
 
 def json_msgpack_handler(wrapped):
     @functools.wraps(wrapped)
     async def wrapper(request):
-        accepted_types = list(
-            AcceptHeader.get_best_accepted_types(
-                request.headers.getone('accept', '*/*'), CONTENT_TYPES
-            )
-        )
+        accepted_types = get_accepted_types(request)
+        base64_bytes = wants_base64(request)
         
         content_type = request.headers.getone('content-type', TYPE_JSON)
 
-        def encoder_for(content_type):
-            if content_type == TYPE_JSON:
-                return lambda e: \
-                    json.dumps(
-                        e, cls=BinaryJsonEncoder, sort_keys=True
-                    ).encode()
-            elif content_type == TYPE_MSGPACK:
-                return functools.partial(msgpack.dumps, use_bin_type=True)
-
-            raise RuntimeError(f"Unsupported content type {content_type!r}")
-
-
-        def response(payload, code=200):
-            for content_type in accepted_types:
-                try:
-                    data = encoder_for(content_type)(payload)
-                except Exception:
-                    continue
-
-                return aiohttp.web.Response(status=code, body=data,
-                                            content_type=content_type)
-            # no acceptable content type
-            code = aiohttp.web.HTTPNotAcceptable.status_code
-            if TYPE_MSGPACK not in accepted_types:
-                # explain how to work around the issue
-                return error(
-                        code,
-                        f"use 'Accept: {TYPE_MSGPACK}' to be able to "
-                        f"receive binary payloads"
-                    )
-            # no encoder can work
-            return aiohttp.web.Response(status=code)
-
-
-        def error(code, msg):
-            return response({'success': False, 'error': msg}, code)
+        def response(payload, code=200, headers=None):
+            try:
+                content_type, data = encode(
+                    payload, accepted_types, base64_bytes)
+            except BinaryPayload:
+                # no acceptable content type
+                code = aiohttp.web.HTTPNotAcceptable.status_code
+                if TYPE_JSON in accepted_types and \
+                        TYPE_MSGPACK not in accepted_types:
+                    return error(code, binary_payload_error())
+                # no encoder can work
+                return aiohttp.web.Response(status=code)
+
+            return aiohttp.web.Response(status=code, body=data,
+                                        content_type=content_type,
+                                        headers=headers)
+
+
+        def error(code, msg, headers=None):
+            return response({'success': False, 'error': msg}, code, headers)
 
         if content_type == TYPE_MSGPACK:
             decoder = functools.partial(msgpack.loads, raw=False)
         else:
             content_type = TYPE_JSON
-            def decoder(e):
-                return json.loads(e.decode())
+            decoder = loads_json
 
         try:
             data = await request.read()
@@ -105,19 +266,44 @@ def json_msgpack_handler(wrapped):
         try:
             # actually execute handler
             result = await wrapped(request, data)
+        except aiohttp.web.HTTPClientError as e:
+            return error(e.status_code, e.text)
+        except (camisole.boxes.NoBoxAvailable,
+                camisole.jobs.JobQueueFull) as e:
+            retry_after = conf['box-queue'].get('retry-after')
+            return error(
+                    aiohttp.web.HTTPServiceUnavailable.status_code,
+                    str(e),
+                    headers={'Retry-After': str(retry_after)}
+                        if retry_after is not None else None
+                )
         except Exception:  # noqa
             return error(
                     aiohttp.web.HTTPInternalServerError.status_code,
                     traceback.format_exc()
                 )
 
-        return response({'success': True, **result})
+        if isinstance(result, aiohttp.web.StreamResponse):
+            # already sent
+            return result
+
+        try:
+            return response({'success': True, **result})
+        except Exception:  # noqa
+            # eg. integers too large for the encoder
+            return error(
+                    aiohttp.web.HTTPInternalServerError.status_code,
+                    traceback.format_exc()
+                )
 
     return wrapper
 
 
-@json_msgpack_handler
-async def run_handler(request, data):
+async def run_submission(data, report=None):
+    """
+    Validate and run the payload of a /run request. ``report`` is called with
+    the parts of the result as soon as they are known.
+    """
     try:
         camisole.schema.validate_run(data)
     except camisole.schema.ValidationError as e:
@@ -125,22 +311,212 @@ async def run_handler(request, data):
 
     lang_name = data['lang'].lower()
     try:
-        lang = camisole.languages.by_name(lang_name)(data)
+        lang = camisole.languages.by_name(lang_name).executer(
+            {**data, 'lang': lang_name})
     except KeyError:
         raise RuntimeError('Incorrect language {}'.format(lang_name))
 
-    return await lang.run()
+    lang.report = report
+
+    checker = data.get('checker')
+    if checker and checker['lang'].lower() not in camisole.languages.all():
+        return {'success': False,
+                'error': f"unknown checker language {checker['lang']}"}
+
+    store = camisole.blobs.blob_store()
+    refs = set()
+
+    for opts in [data.get('execute') or {}, *(data.get('tests') or [])]:
+        refs.update(opts[ref] for ref in ('stdin_ref', 'expected_ref')
+                    if opts.get(ref))
+
+        mode = opts.get('judge_mode')
+        if mode is not None and mode not in camisole.judge.MODES:
+            return {'success': False, 'error': f"unknown judge mode {mode}"}
+
+    with contextlib.ExitStack() as pins:
+        for ref in sorted(refs):
+            try:
+                if store.get(ref) is None:
+                    raise FileNotFoundError(ref)
+                # don't let the inputs be evicted before the tests run
+                pins.enter_context(store.pinned(ref))
+            except FileNotFoundError:
+                # maybe evicted by another process in the meantime
+                return {'success': False, 'error': f"unknown blob {ref}"}
+
+        return await lang.run()
+
+
+async def submission_result(data, report=None):
+    """Result of :func:`run_submission`, with its ``success`` flag."""
+    try:
+        return {'success': True, **await run_submission(data, report)}
+    except Exception:  # noqa
+        return {'success': False, 'error': traceback.format_exc()}
+
+
+@json_msgpack_handler
+async def run_handler(request, data):
+    content_type = get_stream_type(request)
+
+    if content_type is None:
+        return await run_submission(data)
+
+    base64_bytes = wants_base64(request)
+    response = await stream_response(request, content_type)
+    events = asyncio.Queue()
+
+    def report(event, payload):
+        events.put_nowait({'event': event, **payload})
+
+    task = asyncio.ensure_future(submission_result(data, report))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            await response.write(
+                encode_stream_item(content_type, event, base64_bytes))
+
+        result = task.result()
+    finally:
+        task.cancel()
+
+    # the rest of the result has already been sent
+    done = {k: result[k] for k in ('success', 'error') if k in result}
+    await response.write(
+        encode_stream_item(content_type, {'event': 'done', **done},
+                           base64_bytes))
+    await response.write_eof()
+    return response
+
+
+def batch_parallelism():
+    parallelism = conf['batch-parallelism']
+
+    if parallelism is None:
+        # enough submissions to keep the boxes busy, without queuing for them
+        boxes = camisole.isolate.Isolator.isolate_conf.max_boxes
+        parallelism = boxes // (conf['test-parallelism'] * conf['workers'])
+
+    return max(1, parallelism)
+
+
+def batch_submissions(data):
+    """
+    Submissions of a batch, the other fields of the batch being shared by
+    all of them, eg. the tests.
+    """
+    defaults = {k: v for k, v in data.items() if k != 'submissions'}
+    # each submission gets its own copy, since languages may change their
+    # options (eg. Java pops virt-mem)
+    return [{**copy.deepcopy(defaults), **s} for s in data['submissions']]
+
+
+@json_msgpack_handler
+async def run_batch_handler(request, data):
+    try:
+        camisole.schema.validate_batch(data)
+    except camisole.schema.ValidationError as e:
+        return {'success': False, 'error': f"malformed payload: {e}"}
+
+    # the response is always streamed
+    content_type = get_stream_type(request)
+    if content_type is None:
+        accepted_types = get_accepted_types(request)
+        if not accepted_types:
+            return {'success': False, 'error': "no acceptable content type"}
+        content_type = \
+            TYPE_NDJSON if accepted_types[0] == TYPE_JSON else TYPE_MSGPACK
+
+    submissions = batch_submissions(data)
+    base64_bytes = wants_base64(request)
+    response = await stream_response(request, content_type)
+
+    semaphore = asyncio.Semaphore(batch_parallelism())
+
+    async def run(index, submission):
+        async with semaphore:
+            return {'index': index, **await submission_result(submission)}
+
+    tasks = [asyncio.ensure_future(run(i, submission))
+             for i, submission in enumerate(submissions)]
+
+    try:
+        # results are sent as soon as they are ready, whatever their order
+        for future in asyncio.as_completed(tasks):
+            result = {'event': 'result', **await future}
+            await response.write(
+                encode_stream_item(content_type, result, base64_bytes))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    await response.write_eof()
+    return response
+
+
+@json_msgpack_handler
+async def job_submit_handler(request, data):
+    try:
+        camisole.schema.validate_run(data)
+    except camisole.schema.ValidationError as e:
+        return {'success': False, 'error': f"malformed payload: {e}"}
+
+    job = request.app['jobs'].submit(
+        functools.partial(submission_result, data))
+    return job.to_dict()
+
+
+def get_job(request):
+    job = request.app['jobs'].get(request.match_info['id'])
+
+    if job is None:
+        raise aiohttp.web.HTTPNotFound(
+            text=f"unknown job {request.match_info['id']}")
+
+    return job
+
+
+@json_msgpack_handler
+async def job_handler(request, data):
+    job = get_job(request)
+
+    try:
+        wait = float(request.query.get('wait', 0))
+    except ValueError:
+        raise aiohttp.web.HTTPBadRequest(text="wait must be a number")
+
+    if wait > 0:
+        # long-poll
+        await job.wait(min(wait, conf['jobs']['max-wait']))
+
+    return job.to_dict()
+
+
+@json_msgpack_handler
+async def job_delete_handler(request, data):
+    job = get_job(request)
+    request.app['jobs'].discard(job.id)
+    return {}
 
 
 @json_msgpack_handler
 async def test_handler(request, data):
     langs = camisole.languages.all().keys()
     langs -= set(data.get('exclude', []))
+    refresh = request.query.get('refresh', '0') not in ('', '0', 'false')
+
+    langs = sorted(langs)
+    tested = await asyncio.gather(
+        *(request.app['tests'].get(name, refresh) for name in langs))
 
     results = {
                 name: {'success': success, 'raw': raw}
-                    for name in langs
-                    for success, raw in [await camisole.ref.test(name)]
+                    for name, (success, raw) in zip(langs, tested)
             }
 
     return {'results': results}
@@ -153,12 +529,40 @@ async def system_handler(request, data):
 
 @json_msgpack_handler
 async def languages_handler(request, data):
-    return {
-        'languages': {
-            lang: { 'name': cls.df.name, 'programs': cls.df.programs() }
-                for lang, cls in camisole.languages.all().items()
-            }
-        }
+    # health checks poll this endpoint: serve it from memory
+    return request.app['languages'].response(request)
+
+
+async def blob_head_handler(request):
+    store = camisole.blobs.blob_store()
+    path = store.blob_path(request.match_info['sha256'])
+
+    if path is None:
+        return aiohttp.web.Response(status=404)
+
+    return aiohttp.web.Response(
+        headers={'Content-Length': str(path.stat().st_size)})
+
+
+async def blob_put_handler(request):
+    store = camisole.blobs.blob_store()
+
+    try:
+        created = await store.put_stream(
+            request.match_info['sha256'],
+            request.content.iter_chunked(1 << 16))
+    except camisole.blobs.BlobTooLarge as e:
+        return aiohttp.web.json_response(
+            {'success': False, 'error': str(e)},
+            status=aiohttp.web.HTTPRequestEntityTooLarge.status_code)
+    except camisole.blobs.BlobError as e:
+        return aiohttp.web.json_response(
+            {'success': False, 'error': str(e)},
+            status=aiohttp.web.HTTPBadRequest.status_code)
+
+    return aiohttp.web.json_response(
+        {'success': True},
+        status=aiohttp.web.HTTPCreated.status_code if created else 200)
 
 
 async def default_handler(request):
@@ -167,10 +571,93 @@ async def default_handler(request):
         )
 
 
-def make_application(**kwargs):
+async def snapshot_languages(app):
+    # the program versions are only probed if their binary changed since
+    # the snapshot on disk, and never on the request path
+    await camisole.versions.probe_all()
+    app['languages'] = CachedPayload({
+        'languages': {
+            lang: {'name': cls.name, 'programs': cls.programs()}
+            for lang, cls in camisole.languages.all().items()
+        }
+    })
+
+
+async def setup_languages(app):
+    async def setup():
+        setups = [lang.executer.setup()
+                  for lang in camisole.languages.all().values()]
+        for result in await asyncio.gather(*setups, return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.error("language setup failed", exc_info=result)
+
+    # languages work without their setup, if only more slowly: don't delay
+    # the startup for it
+    app['language_setup'] = asyncio.ensure_future(setup())
+
+
+async def cancel_language_setup(app):
+    app['language_setup'].cancel()
+
+
+async def setup_jobs(app):
+    settings = conf['jobs']
+    spool = None
+
+    if conf['workers'] > 1:
+        # jobs can be looked up from any worker
+        spool = pathlib.Path(conf['cache-dir']).expanduser() / 'jobs'
+
+    app['jobs'] = camisole.jobs.JobStore(
+        settings['size'], settings['ttl'], batch_parallelism(),
+        max_pending=settings.get('max-pending'), spool=spool)
+
+
+async def cancel_jobs(app):
+    app['jobs'].cancel_all()
+
+
+async def setup_tests(app):
+    app['tests'] = camisole.ref.TestResults(
+        conf['self-test']['ttl'], batch_parallelism())
+
+
+async def cancel_tests(app):
+    app['tests'].cancel_all()
+
+
+async def warm_up_boxes(app):
+    if conf['warm-boxes']:
+        await camisole.isolate.Isolator.warm_pool.warm_up()
+
+
+async def drain_boxes(app):
+    if conf['warm-boxes']:
+        await camisole.isolate.Isolator.warm_pool.drain()
+
+
+def make_application(language_setup=True, **kwargs):
     app = aiohttp.web.Application(**kwargs)
 
+    app.on_startup.append(snapshot_languages)
+    if language_setup:
+        app.on_startup.append(setup_languages)
+        app.on_cleanup.append(cancel_language_setup)
+    app.on_startup.append(setup_jobs)
+    app.on_startup.append(setup_tests)
+    app.on_startup.append(warm_up_boxes)
+    app.on_cleanup.append(cancel_jobs)
+    app.on_cleanup.append(cancel_tests)
+    app.on_cleanup.append(drain_boxes)
+
     app.router.add_route('POST', '/run', run_handler)
+    app.router.add_route('POST', '/run/batch', run_batch_handler)
+    app.router.add_route('POST', '/jobs', job_submit_handler)
+    app.router.add_route('GET', '/jobs/{id}', job_handler)
+    app.router.add_route('DELETE', '/jobs/{id}', job_delete_handler)
+    blob = '/blobs/{sha256:%s}' % camisole.blobs.RE_KEY.pattern
+    app.router.add_route('HEAD', blob, blob_head_handler)
+    app.router.add_route('PUT', blob, blob_put_handler)
     app.router.add_route('*', '/', default_handler)
     app.router.add_route('*', '/languages', languages_handler)
     app.router.add_route('*', '/system', system_handler)
@@ -180,7 +667,26 @@ def make_application(**kwargs):
 
 
 def run(**kwargs):  # noqa
-    from camisole.conf import conf
-
-    app = make_application(client_max_size=conf['max-body-size'])
-    aiohttp.web.run_app(app, **kwargs)
+    workers = conf['workers']
+
+    if workers <= 1:
+        app = make_application(client_max_size=conf['max-body-size'])
+        aiohttp.web.run_app(app, **kwargs)
+        return
+
+    def worker(index):
+        logging.info("worker %d started (pid %d)", index, os.getpid())
+        # the languages setup is shared, do it once
+        app = make_application(language_setup=index == 0,
+                               client_max_size=conf['max-body-size'])
+        # every worker listens on the same port, the kernel balances the
+        # connections between them
+        aiohttp.web.run_app(app, reuse_port=True, print=None, **kwargs)
+
+    # probe the program versions once for all the workers, which then find
+    # them in the snapshot
+    asyncio.run(camisole.versions.probe_all())
+
+    print(f"======== Running on http://{kwargs.get('host')}:"
+          f"{kwargs.get('port')} with {workers} workers ========")
+    camisole.workers.prefork(workers, worker)
@@ -27,6 +27,7 @@ import pathlib
 import subprocess
 import tempfile
 
+import camisole.boxes
 from camisole.conf import conf
 from camisole.utils import cached_classmethod
 
@@ -48,12 +49,32 @@ async def communicate(cmdline, data=None, **kwargs):
         stderr=subprocess.PIPE, **kwargs
     )
 
-    stdout, stderr = await proc.communicate(data)
+    try:
+        stdout, stderr = await proc.communicate(data)
+    except asyncio.CancelledError:
+        # don't leave the process running behind us
+        proc.kill()
+        await proc.wait()
+        raise
+
     retcode = await proc.wait()
 
     return retcode, stdout, stderr
 
 
+def read_limited(path, limit):
+    """
+    Read at most ``limit`` bytes (everything if None) of a file, and tell
+    whether it was longer than that.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if limit is None or size <= limit:
+            return f.read(), False
+
+        return f.read(limit), True
+
+
 CAMISOLE_OPTIONS = [
     'extra-time',
     'fsize',
@@ -128,36 +149,23 @@ class Isolator:
 
 
     async def __aenter__(self):
-        busy = {int(p.name) for p in self.isolate_conf.root.iterdir()} # type: ignore
-        avail = set(range(self.isolate_conf.max_boxes)) - busy # type: ignore
-
-        while avail:
-            self.box_id = avail.pop()
-            self.cmd_base = ['isolate', '--box-id', str(self.box_id), '--cg']
-
-            cmd_init = self.cmd_base + ['--init']
-
-            retcode, stdout, stderr = await communicate(cmd_init)
-
-            if retcode == 2 and b"already exists" in stderr:
-                continue
-
-            if retcode != 0:  # noqa
-                raise RuntimeError(
-                    "{} returned code {}: “{}”"
-                    .format(cmd_init, retcode, stderr)
-                )
-            break
-        else:
-            raise RuntimeError("No isolate box ID available.")
-
-        self.path = pathlib.Path(stdout.strip().decode()) / 'box'
+        self.box_id, root = await self.warm_pool.acquire()
+        self.cmd_base = camisole.boxes.box_command(self.box_id)
+        self.path = root / 'box'
         self.meta_file = tempfile.NamedTemporaryFile(prefix='camisole-meta-')
         self.meta_file.__enter__()
 
         return self
 
     async def __aexit__(self, exc, value, tb):
+        try:
+            if self.info is None:
+                self.read_meta()
+        finally:
+            self.meta_file.__exit__(exc, value, tb)
+            await self.warm_pool.release(self.box_id)
+
+    def read_meta(self):
         meta_defaults = {
             'cg-mem': 0,
             'cg-oom-killed': 0,
@@ -170,10 +178,12 @@ class Isolator:
             'max-rss': 0,
             'message': None,
             'status': 'OK',
+            'stderr-truncated': False,
+            'stdout-truncated': False,
             'time': 0.0,
             'time-wall': 0.0,
         }
-    
+
         with open(self.meta_file.name) as f:
             m = (line.strip() for line in f.readlines())
 
@@ -218,18 +228,8 @@ class Isolator:
             'meta': self.meta
         }
 
-        cmd_cleanup = self.cmd_base + ['--cleanup']
-        retcode, stdout, stderr = await communicate(cmd_cleanup)
-
-        if retcode != 0:  # noqa
-            raise RuntimeError(
-                "{} returned code {}: “{}”"
-                .format(cmd_cleanup, retcode, stderr)
-            )
-
-        self.meta_file.__exit__(exc, value, tb)
-
-    async def run(self, cmdline, data=None, env=None, merge_outputs=False, **kwargs):
+    async def run(self, cmdline, data=None, env=None, merge_outputs=False,
+                  stdin=None, read_stdout=True, **kwargs):
         cmd_run = self.cmd_base[:]
         cmd_run += list(
                 itertools.chain(
@@ -261,6 +261,10 @@ class Isolator:
             '--stdout={}'.format(self.stdout_file),
         ]
 
+        if stdin is not None:
+            # path in the box, rather than data piped through isolate
+            cmd_run.append('--stdin={}'.format(stdin))
+
         if merge_outputs:
             cmd_run.append('--stderr-to-stdout')
         else:
@@ -269,6 +273,9 @@ class Isolator:
         cmd_run += ['--run', '--']
         cmd_run += cmdline
 
+        # a box can be used for several runs, don't keep the previous result
+        self.info = None
+
         self.isolate_retcode, self.isolate_stdout, self.isolate_stderr = \
             (
                 await communicate(cmd_run, data=data, **kwargs)
@@ -276,6 +283,7 @@ class Isolator:
 
         self.stdout = b''
         self.stderr = b''
+        truncated = {}
 
         if self.isolate_retcode >= 2:  # Internal error
             raise IsolateInternalError(
@@ -283,11 +291,26 @@ class Isolator:
                 self.isolate_stdout,
                 self.isolate_stderr
             )
+        # don't let a program flood the server memory with its output;
+        # requests can only lower the configured limit
+        limit = conf['output-limit']
+        requested = self.opts.get('output-limit')
+        if requested is not None:
+            # a negative limit would read everything
+            requested = max(0, requested)
+            limit = requested if limit is None else min(requested, limit)
+
         try:
-            self.stdout = (self.path / self.stdout_file).read_bytes()
+            if read_stdout:
+                self.stdout, truncated['stdout-truncated'] = read_limited(
+                    self.path / self.stdout_file, limit)
+            else:
+                # left in the box, eg. to be compared with the expected one
+                self.stdout = None
 
             if not merge_outputs:
-                self.stderr = (self.path / self.stderr_file).read_bytes()
+                self.stderr, truncated['stderr-truncated'] = read_limited(
+                    self.path / self.stderr_file, limit)
 
         except (IOError, PermissionError) as e:
             # Something went wrong, isolate was killed before changing the
@@ -296,9 +319,12 @@ class Isolator:
                 cmd_run,
                 self.isolate_stdout,
                 self.isolate_stderr,
-                message="Error while reading stdout/stderr: " + e.message,
+                message="Error while reading stdout/stderr: " + str(e),
             )
 
+        self.read_meta()
+        self.meta.update(truncated)
+
     @cached_classmethod
     def isolate_conf(cls):
         parser = configparser.ConfigParser()
@@ -311,10 +337,27 @@ class Isolator:
                 yield from f
 
         parser.read_file(dummy_section())
-        root = pathlib.Path(parser.get(s, 'box_root'))
         max_boxes = parser.getint(s, 'num_boxes')
 
-        return (
-                collections.namedtuple('conf', 'root, max_boxes')
-                (root, max_boxes)
-            )
+        return collections.namedtuple('conf', 'max_boxes')(max_boxes)
+
+    @cached_classmethod
+    def box_pool(cls):
+        queue = conf['box-queue']
+        locks = None
+
+        if conf['workers'] > 1:
+            # the boxes are shared with the other worker processes
+            locks = camisole.boxes.BoxLocks(
+                pathlib.Path(conf['cache-dir']).expanduser() / 'box-locks')
+
+        return camisole.boxes.BoxPool(
+            cls.isolate_conf.max_boxes,
+            max_waiters=queue.get('max-length'),
+            timeout=queue.get('timeout'),
+            locks=locks)
+
+    @cached_classmethod
+    def warm_pool(cls):
+        return camisole.boxes.WarmBoxPool(
+            cls.box_pool, size=conf['warm-boxes'])
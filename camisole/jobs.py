@@ -0,0 +1,229 @@
+import asyncio
+import collections
+import logging
+import os
+import pickle
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+RE_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class JobQueueFull(RuntimeError):
+    def __init__(self, message="Too many jobs waiting to be run."):
+        super().__init__(message)
+
+
+class Job:
+    """A submission running in the background, and then its result."""
+
+    def __init__(self, id: str):
+        self.id = id
+        self.status = 'queued'
+        self.result: Optional[dict] = None
+        # size of the pickled result, accounted in the store
+        self.size = 0
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+        self.task: Optional[asyncio.Future] = None
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.status}>"
+
+    def to_dict(self) -> dict:
+        info = {'id': self.id, 'status': self.status}
+
+        if self.result is not None:
+            info['result'] = self.result
+
+        return info
+
+    async def wait(self, timeout: float) -> None:
+        """Wait for the job to finish, for at most ``timeout`` seconds."""
+        try:
+            await asyncio.wait_for(self.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class SpooledJob(Job):
+    """
+    Job of another process, known from its spool file: empty while the job
+    is not finished, then holding its pickled result.
+    """
+
+    poll_interval = .1
+
+    def __init__(self, id: str, path: Path):
+        super().__init__(id)
+        # not known to other processes than the one running the job
+        self.status = 'running'
+        self.path = path
+
+    def load(self) -> bool:
+        """Read the result if the job is finished, and tell if it is."""
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return False
+
+        if data:
+            self.result = pickle.loads(data)
+            self.status = 'done'
+
+        return bool(data)
+
+    async def wait(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+
+        while not self.load() and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+
+
+class JobStore:
+    """
+    Jobs running in the background, at most ``parallelism`` at the same time
+    and at most ``max_pending`` (unbounded if ``None``) not finished yet.
+
+    The results of finished jobs are kept for ``ttl`` seconds, and as long
+    as they take at most ``max_size`` bytes (pickled), the oldest ones being
+    evicted first. Eviction happens when jobs are submitted, looked up or
+    finished.
+
+    With a ``spool`` directory, the jobs are also known to the other
+    processes sharing it: each job has a file there, holding its result once
+    it is finished.
+    """
+
+    def __init__(self, max_size: int, ttl: float, parallelism: int,
+                 max_pending: Optional[int] = None,
+                 spool: Optional[Path] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.spool = spool
+        self.semaphore = asyncio.Semaphore(parallelism)
+        self.jobs: dict[str, Job] = {}
+        # finished jobs, oldest first
+        self.finished: collections.OrderedDict[str, Job] = \
+            collections.OrderedDict()
+        self.size = 0
+        self.pending = 0
+
+        if self.spool is not None:
+            self.spool.mkdir(parents=True, exist_ok=True)
+            self._clean_spool()
+
+    def __repr__(self):
+        return (f"<JobStore {self.pending} pending, "
+                f"{len(self.finished)} finished, "
+                f"{self.size}/{self.max_size} bytes>")
+
+    def submit(self, func: Callable[[], Awaitable[dict]]) -> Job:
+        self.evict()
+
+        if self.max_pending is not None and self.pending >= self.max_pending:
+            raise JobQueueFull()
+
+        job = Job(uuid.uuid4().hex)
+        self.jobs[job.id] = job
+
+        if self.spool is not None:
+            (self.spool / job.id).touch()
+
+        self.pending += 1
+        job.task = asyncio.ensure_future(self._run(job, func))
+        # also called if the job is cancelled before it starts
+        job.task.add_done_callback(self._release)
+        return job
+
+    def _release(self, task: asyncio.Future) -> None:
+        self.pending -= 1
+
+    async def _run(self, job: Job, func: Callable[[], Awaitable[dict]]):
+        async with self.semaphore:
+            job.status = 'running'
+            result = await func()
+
+        job.result = result
+        job.status = 'done'
+        job.size = len(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        job.finished_at = time.monotonic()
+        job.done.set()
+
+        if self.spool is not None and job.id in self.jobs:
+            tmp = self.spool / f'.{job.id}'
+            tmp.write_bytes(
+                pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+            os.replace(tmp, self.spool / job.id)
+
+        if job.id in self.jobs:
+            self.finished[job.id] = job
+            self.size += job.size
+            self.evict()
+
+    def get(self, id: str) -> Optional[Job]:
+        self.evict()
+        job = self.jobs.get(id)
+
+        if job is None and self.spool is not None and RE_ID.fullmatch(id):
+            job = SpooledJob(id, self.spool / id)
+            if not job.path.exists():
+                return None
+            job.load()
+
+        return job
+
+    def discard(self, id: str) -> Optional[Job]:
+        """
+        Forget a job, cancelling it if it is not finished. Jobs of other
+        processes can't be cancelled, only their result forgotten.
+        """
+        if self.spool is not None and RE_ID.fullmatch(id):
+            try:
+                (self.spool / id).unlink()
+            except FileNotFoundError:
+                pass
+
+        job = self.jobs.pop(id, None)
+        if job is None:
+            return None
+
+        if job.task is not None:
+            job.task.cancel()
+
+        if self.finished.pop(id, None) is not None:
+            self.size -= job.size
+
+        return job
+
+    def evict(self) -> None:
+        now = time.monotonic()
+
+        for job in list(self.finished.values()):
+            if self.size <= self.max_size and job.finished_at + self.ttl > now:
+                return
+
+            logger.debug("evicting %r", job)
+            self.discard(job.id)
+
+    def _clean_spool(self) -> None:
+        # files left by dead processes
+        deadline = time.time() - self.ttl
+
+        for path in self.spool.iterdir():
+            try:
+                if path.stat().st_mtime < deadline:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def cancel_all(self) -> None:
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
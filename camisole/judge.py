@@ -0,0 +1,153 @@
+import itertools
+import math
+import re
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 1 << 16
+# tokens longer than that are never equal to anything
+MAX_TOKEN_SIZE = 1 << 20
+# bytes of each side shown around the first difference
+EXCERPT_SIZE = 64
+
+RE_TOKEN = re.compile(rb'\S+')
+
+MODES = ('exact', 'whitespace', 'float')
+# of the float mode
+DEFAULT_TOLERANCE = 1e-6
+
+
+def chunks(f: BinaryIO) -> Iterator[bytes]:
+    return iter(lambda: f.read(CHUNK_SIZE), b'')
+
+
+def tokens(f: BinaryIO) -> Iterator[Tuple[Optional[bytes], int]]:
+    """
+    Whitespace-separated tokens of a file, with their offset. A token too long
+    to be kept in memory is returned as None, and ends the iteration.
+    """
+    offset = 0
+    pending = b''
+
+    for chunk in chunks(f):
+        data = pending + chunk
+        base = offset - len(pending)
+        offset += len(chunk)
+        pending = b''
+
+        for match in RE_TOKEN.finditer(data):
+            if match.end() == len(data):
+                # the token may go on in the next chunk
+                pending = match.group()
+                if len(pending) > MAX_TOKEN_SIZE:
+                    yield None, base + match.start()
+                    return
+                break
+            yield match.group(), base + match.start()
+
+    if pending:
+        yield pending, offset - len(pending)
+
+
+def first_difference_exact(output: BinaryIO,
+                           expected: BinaryIO) -> Optional[Tuple[int, int]]:
+    offset = 0
+
+    while True:
+        a = output.read(CHUNK_SIZE)
+        b = expected.read(CHUNK_SIZE)
+
+        if a != b:
+            common = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y),
+                          min(len(a), len(b)))
+            return offset + common, offset + common
+
+        if not a:
+            return None
+
+        offset += len(a)
+
+
+def first_difference_tokens(output: BinaryIO, expected: BinaryIO,
+                            equal) -> Optional[Tuple[int, int]]:
+    for got, want in itertools.zip_longest(tokens(output), tokens(expected)):
+        if got is None or want is None:
+            # one of the sides is shorter
+            return (got[1] if got else end(output),
+                    want[1] if want else end(expected))
+
+        if got[0] is None or want[0] is None or not equal(got[0], want[0]):
+            return got[1], want[1]
+
+    return None
+
+
+def end(f: BinaryIO) -> int:
+    return f.seek(0, 2)
+
+
+def float_equal(tolerance: float):
+    def equal(got: bytes, want: bytes) -> bool:
+        if got == want:
+            return True
+
+        try:
+            a, b = float(got), float(want)
+        except ValueError:
+            return False
+
+        if math.isnan(a) or math.isnan(b):
+            return math.isnan(a) and math.isnan(b)
+
+        # absolute error for small values, relative error for large ones
+        return abs(a - b) <= tolerance * max(1.0, abs(b))
+
+    return equal
+
+
+def excerpt(f: BinaryIO, offset: int) -> str:
+    f.seek(max(0, offset - EXCERPT_SIZE // 2))
+    # the excerpt may cut through multibyte characters
+    return f.read(EXCERPT_SIZE).decode(errors='replace')
+
+
+def judge(output: Path, expected: Path, mode: str = 'exact',
+          tolerance: float = DEFAULT_TOLERANCE) -> dict:
+    """
+    Compare the output of a program with the expected output, reading both
+    files in chunks. Return the verdict, along with an excerpt of both files
+    around the first difference.
+
+    The ``mode`` is one of:
+
+    - ``exact``: outputs must be identical, byte for byte
+    - ``whitespace``: outputs must have the same whitespace-separated tokens
+    - ``float``: same as ``whitespace``, but numbers are equal if they differ
+      by at most ``tolerance`` (absolute or relative error)
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown judge mode {mode!r}")
+
+    with output.open('rb') as got, expected.open('rb') as want:
+        if mode == 'exact':
+            difference = first_difference_exact(got, want)
+        elif mode == 'whitespace':
+            difference = first_difference_tokens(got, want, bytes.__eq__)
+        else:
+            difference = first_difference_tokens(got, want,
+                                                 float_equal(tolerance))
+
+        if difference is None:
+            return {'verdict': 'OK', 'mode': mode}
+
+        output_offset, expected_offset = difference
+        return {
+            'verdict': 'WRONG_ANSWER',
+            'mode': mode,
+            'diff': {
+                'output': {'offset': output_offset,
+                           'excerpt': excerpt(got, output_offset)},
+                'expected': {'offset': expected_offset,
+                             'excerpt': excerpt(want, expected_offset)},
+            },
+        }
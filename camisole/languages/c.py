@@ -1,4 +1,14 @@
-from camisole.models import LangDefinition, Program
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List
+
+import camisole.cache
+import camisole.isolate
+from camisole.conf import conf
+from camisole.models import LangDefinition, LangExecution, Program
 
 reference=r'''
 #include <stdio.h>
@@ -10,8 +20,119 @@ int main(void)
 }
 '''
 
+PCH_MOUNT = '/pch'
+
+
+class PrecompiledHeadersExecution(LangExecution):
+    """
+    Compile with precompiled versions of ``precompiled_headers``, which are
+    built at startup for the current compiler version and options, and
+    mounted read-only on /pch in the compilation boxes.
+
+    Each header is shadowed by a stub including the actual header, which gcc
+    falls back to whenever it cannot use the precompiled one (eg. when the
+    source defines macros before including it).
+    """
+    precompiled_headers: List[str] = []
+    header_language = 'c-header'
+
+
+    @classmethod
+    def pch_opts(cls):
+        # linker options are irrelevant to headers
+        return [opt for opt in cls.df.compiler.opts if not opt.startswith('-l')]
+
+
+    @classmethod
+    def pch_dir(cls) -> Path:
+        compiler = cls.df.compiler
+        key = camisole.cache.digest(compiler.cmd, compiler.version(),
+                                    cls.pch_opts(), cls.precompiled_headers)
+        return (Path(conf['cache-dir']).expanduser() / 'pch' /
+                cls.df.name.lower() / key)
+
+
+    @classmethod
+    async def setup(cls):
+        if not cls.precompiled_headers:
+            return
+
+        path = cls.pch_dir()
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # headers built by other compiler versions or options are stale
+        for entry in path.parent.iterdir():
+            if entry != path:
+                shutil.rmtree(entry, ignore_errors=True)
+
+        if path.is_dir():
+            return
+
+        # build aside, so that no compilation sees a partial directory
+        tmp = Path(tempfile.mkdtemp(dir=path.parent))
+        try:
+            for header in cls.precompiled_headers:
+                await cls.build_header(tmp, header)
+            tmp.chmod(0o755)
+            os.replace(tmp, path)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+    @classmethod
+    async def build_header(cls, root: Path, header: str):
+        stub = root / header
+        gch = root / (header + '.gch')
+        source = root / 'source.h'
+
+        stub.parent.mkdir(parents=True, exist_ok=True)
+        stub.write_text(f'#include_next <{header}>\n')
+        source.write_text(f'#include <{header}>\n')
+
+        cmd = [cls.df.compiler.cmd, *cls.pch_opts(),
+               '-x', cls.header_language, str(source), '-o', str(gch)]
+        retcode, stdout, stderr = await camisole.isolate.communicate(cmd)
+        source.unlink()
+
+        if retcode != 0:
+            logging.warning("%s: could not precompile <%s>: %s", cls.df.name,
+                            header, stderr.decode(errors='replace'))
+            stub.unlink()
+
+
+    def precompiled_headers_dir(self):
+        if not self.precompiled_headers:
+            return None
+
+        path = self.pch_dir()
+        return path if path.is_dir() else None
+
+
+    def compile_allowed_dirs(self):
+        allowed_dirs = super().compile_allowed_dirs()
+
+        path = self.precompiled_headers_dir()
+        if path is not None:
+            allowed_dirs.append(f'{PCH_MOUNT}={path}')
+
+        return allowed_dirs
+
+
+    def compile_command(self, source, output):
+        cmd = super().compile_command(source, output)
+
+        if self.precompiled_headers_dir() is not None:
+            cmd[1:1] = ['-I', PCH_MOUNT]
+
+        return cmd
+
+
+class CExecution(PrecompiledHeadersExecution):
+    pass
+
+
 class C(LangDefinition):
     source_ext = '.c'
     compiler = Program('gcc',  opts=['-std=c11', '-Wall', '-Wextra', '-O2', '-lm'])
     reference_source = reference
-
+    executer = CExecution
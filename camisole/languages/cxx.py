@@ -1,3 +1,4 @@
+from camisole.languages.c import PrecompiledHeadersExecution
 from camisole.models import LangDefinition, Program
 
 reference=r'''
@@ -9,8 +10,14 @@ int main()
 }
 '''
 
+class CXXExecution(PrecompiledHeadersExecution):
+    # included by most competitive programming sources
+    precompiled_headers = ['bits/stdc++.h']
+    header_language = 'c++-header'
+
+
 class CXX(LangDefinition, name="C++"):
     source_ext = '.cc'
     compiler = Program('g++', opts=['-std=c++17', '-Wall', '-Wextra', '-O2'])
     reference_source = reference
-
+    executer = CXXExecution
@@ -1,4 +1,10 @@
-from camisole.models import LangDefinition, Program
+import logging
+import os
+from pathlib import Path
+
+import camisole.isolate
+from camisole.conf import conf
+from camisole.models import LangExecution, LangDefinition, Program
 
 reference = r'''
 package main
@@ -8,10 +14,55 @@ func main() {
 }
 '''
 
+# The Go build cache lives outside of the boxes, so that it survives box
+# cleanups, and is shared by all of them. It is filled with the standard
+# library at startup, and mounted read-only in the boxes: go(1) only writes to
+# its cache on a best effort basis, so compilations still work, but cannot
+# tamper with what other compilations will read.
+GOCACHE_MOUNT = '/gocache'
+
+
+def build_cache_dir() -> Path:
+    return Path(conf['cache-dir']).expanduser() / 'go'
+
+
+class GoExecution(LangExecution):
+    @classmethod
+    async def setup(cls):
+        path = build_cache_dir()
+        path.mkdir(parents=True, exist_ok=True)
+
+        cmd = [cls.df.compiler.cmd, 'build', 'std']
+        retcode, stdout, stderr = await camisole.isolate.communicate(
+            cmd, env={**os.environ, 'GOCACHE': str(path)})
+
+        if retcode != 0:
+            logging.warning("could not warm up the Go build cache: %s",
+                            stderr.decode(errors='replace'))
+
+
+    def compile_allowed_dirs(self):
+        allowed_dirs = super().compile_allowed_dirs()
+
+        if build_cache_dir().is_dir():
+            allowed_dirs.append(f'{GOCACHE_MOUNT}={build_cache_dir()}')
+
+        return allowed_dirs
+
+
+    def compile_env(self):
+        env = super().compile_env()
+
+        if build_cache_dir().is_dir():
+            env = {**env, 'GOCACHE': GOCACHE_MOUNT}
+
+        return env
+
+
 class Go(LangDefinition):
     source_ext = '.go'
     compiler = Program('go', opts=['build', '-buildmode=exe'],
                        version_opt='version',
                        env={'GOCACHE':'/box/.gocache'})
     reference_source = reference
-
+    executer = GoExecution
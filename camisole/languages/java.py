@@ -1,8 +1,9 @@
 import re
-import subprocess
+import struct
 from pathlib import Path
+from typing import Optional
 
-from camisole.models import LangExecution, LangDefinition, Program
+from camisole.models import CompiledFile, LangExecution, LangDefinition, Program
 
 reference = r'''
 class MyπClass {
@@ -26,27 +27,172 @@ class MyπClass {
 # method is defined, however deep in the class tree.
 
 # Quick explanation how the Java compile/execute workflow works:
-# 1.  source is written in a file named 1337.java; '1337' cannot be used as a
-#     class name (identifiers cannot start with a number) so this will trigger
-#     the error explained in 3a.
+# 0.  the source is quickly scanned for a root *public* class (see
+#     find_public_class()); if one is found, it is written in a file named
+#     after it and compiled once, which is the common case
+# 1.  otherwise, source is written in a file named 1337.java; '1337' cannot be
+#     used as a class name (identifiers cannot start with a number) so this
+#     will trigger the error explained in 3a.
 # 2.  compile (javac) that 1337.java file
-# 3a. if source contains a root *public* class, javac will complain that its
-#     name is different than the .java filename (1337.java), hence:
+# 3a. if source contains a root *public* class the scan missed, javac will
+#     complain that its name is different than the .java filename, hence:
 #     4a. we look for the actual class name by parsing javac stderr output
 #     5a. compile again with the new, actual class name as filename
 # 3b. if there is no public class, javac will not complain but produce
 #     one or multiple .class files (one per class and nested class), hence:
-#     4b. we iterate over every *.class in the output directory, running javap
-#         (disassembler) so as to find a main() signature
+#     4b. we iterate over every *.class in the output directory, parsing the
+#         class file (see has_main()) so as to find a main() signature
 #     5b. we stop at the first valid main() signature and use the .class file
 #         it belongs to as java (interpreter) target.
 
 RE_WRONG_FILENAME_ERROR = re.compile(r'error:\s+class\s+(.+?)\s+is\s+public,')
-PSVMAIN_DESCRIPTOR = 'descriptor: ([Ljava/lang/String;)V'
+PSVMAIN_DESCRIPTOR = b'([Ljava/lang/String;)V'
+
+# comments, text blocks, string and char literals, and braces
+RE_SOURCE_TOKEN = re.compile(r'''
+    //[^\n]*
+  | /\*.*?(?:\*/|$)
+  | """.*?(?:(?<!\\)"""|$)
+  | "(?:\\.|[^"\\\n])*"?
+  | '(?:\\.|[^'\\\n])*'?
+  | [{}]
+''', re.DOTALL | re.VERBOSE)
+RE_PUBLIC_CLASS = re.compile(
+    r'(?<![\w$])public\s+'
+    r'(?:(?:abstract|final|static|strictfp|sealed|non-sealed)\s+)*'
+    r'(?:class|interface|enum|record|@\s*interface)\s+([\w$]+)')
+
+ACC_PUBLIC = 0x0001
+ACC_STATIC = 0x0008
+
+# size of the constant pool entries, by tag, not counting the tag itself
+# https://docs.oracle.com/javase/specs/jvms/se21/html/jvms-4.html#jvms-4.4
+CONSTANT_UTF8 = 1
+CONSTANT_SIZES = {
+    3: 4,  # Integer
+    4: 4,  # Float
+    5: 8,  # Long
+    6: 8,  # Double
+    7: 2,  # Class
+    8: 2,  # String
+    9: 4,  # Fieldref
+    10: 4,  # Methodref
+    11: 4,  # InterfaceMethodref
+    12: 4,  # NameAndType
+    15: 3,  # MethodHandle
+    16: 2,  # MethodType
+    17: 4,  # Dynamic
+    18: 4,  # InvokeDynamic
+    19: 2,  # Module
+    20: 2,  # Package
+}
+
+
+def find_public_class(source: str) -> Optional[str]:
+    """
+    Name of the root public class (or interface, enum, record) declared in a
+    Java source, without running javac.
+
+    This is only a heuristic: comments and literals are blanked out and only
+    the code outside of any braces is considered.
+    """
+    top_level = []
+    depth = 0
+    start = 0
+
+    for match in RE_SOURCE_TOKEN.finditer(source):
+        token = match.group()
+        if depth == 0:
+            top_level.append(source[start:match.start()])
+        start = match.end()
+
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth = max(depth - 1, 0)
+        if depth == 0:
+            top_level.append(' ')
+
+    if depth == 0:
+        top_level.append(source[start:])
+
+    match = RE_PUBLIC_CLASS.search(''.join(top_level))
+    return match.group(1) if match else None
+
+
+def has_main(data: bytes) -> bool:
+    """
+    Whether a class file declares ``public static void main(String[])``.
+
+    Only the constant pool and the method table are parsed, which is all we
+    need to find method names, descriptors and access flags.
+    """
+    u2 = struct.Struct('>H').unpack_from
+    u4 = struct.Struct('>I').unpack_from
+
+    try:
+        if u4(data, 0)[0] != 0xCAFEBABE:
+            return False
+
+        count, = u2(data, 8)
+        utf8 = {}
+        offset = 10
+        index = 1
+
+        while index < count:
+            tag = data[offset]
+            offset += 1
+
+            if tag == CONSTANT_UTF8:
+                length, = u2(data, offset)
+                utf8[index] = data[offset + 2:offset + 2 + length]
+                offset += 2 + length
+            else:
+                offset += CONSTANT_SIZES[tag]
+
+            # 8-byte constants take two slots
+            index += 2 if tag in (5, 6) else 1
+
+        # access flags, this class, super class
+        offset += 6
+        interfaces, = u2(data, offset)
+        offset += 2 + 2 * interfaces
+
+        def skip_attributes(offset):
+            attributes, = u2(data, offset)
+            offset += 2
+            for _ in range(attributes):
+                offset += 6 + u4(data, offset + 2)[0]
+            if offset > len(data):
+                raise IndexError("truncated attribute")
+            return offset
+
+        fields, = u2(data, offset)
+        offset += 2
+        for _ in range(fields):
+            offset = skip_attributes(offset + 6)
+
+        methods, = u2(data, offset)
+        offset += 2
+        for _ in range(methods):
+            flags, name, descriptor = struct.unpack_from('>HHH', data, offset)
+            offset = skip_attributes(offset + 6)
+
+            if (flags & (ACC_PUBLIC | ACC_STATIC) == ACC_PUBLIC | ACC_STATIC
+                    and utf8.get(name) == b'main'
+                    and utf8.get(descriptor) == PSVMAIN_DESCRIPTOR):
+                return True
+
+    except (IndexError, KeyError, struct.error):
+        # truncated or unknown class file format
+        pass
+
+    return False
 
 
 class JavaExecution(LangExecution):
     compiled_ext = '.class'
+    compile_state = ('class_name', 'found_public')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -73,9 +219,18 @@ class JavaExecution(LangExecution):
         return []
 
 
-    async def compile(self):
-        # try to compile with default class name (Main)
-        retcode, info, binary = await super().compile()
+    async def compile(self, isolator=None):
+        source = self.opts.get('source', '')
+        if isinstance(source, bytes):
+            source = source.decode(errors='replace')
+
+        public_class = find_public_class(source)
+        if public_class:
+            self.found_public = True
+            self.class_name = public_class
+
+        # try to compile with the class name found, or an illegal one
+        retcode, info, binary = await super().compile(isolator)
         assert info is not None, "compile() should return info dict"
 
         if retcode != 0:
@@ -87,11 +242,11 @@ class JavaExecution(LangExecution):
                 raise RuntimeError(
                     "could not decode javac stderr to find class name")
             match = RE_WRONG_FILENAME_ERROR.search(javac_stderr)
-            if match:
+            if match and match.group(1) != self.class_name:
                 self.found_public = True
                 self.class_name = match.group(1)
                 # retry with new name
-                retcode, info, binary = await super().compile()
+                retcode, info, binary = await super().compile(isolator)
 
         return (retcode, info, binary)
 
@@ -121,60 +276,29 @@ class JavaExecution(LangExecution):
         return cmd
 
 
-    def find_class_having_main(self, classes):
-        assert self.df.compiler, "compiler should be defined in the language definition"
-
-        for file in classes:
-            # run javap(1) with type signatures
-            try:
-                stdout = subprocess.check_output(
-                                        [self.df.extra_binaries['disassembler'].cmd, '-s', str(file)],
-                                        stderr=subprocess.DEVNULL,
-                                        env=self.df.compiler.env
-                                    )
-            except subprocess.SubprocessError:  # noqa
-                continue
-
-            # iterate on lines to find p s v main() signature and then
-            # its descriptor on the line below; we don't rely on the type
-            # from the signature, because it could be String[], String... or
-            # some other syntax I'm not even aware of
-            lines = iter(stdout.decode().split('\n'))
-
-            for line in lines:
-                line = line.lstrip()
+    def find_class_having_main(self, files):
+        for name, path in files:
+            if has_main(path.read_bytes()):
+                return Path(name).stem
 
-                if line.startswith('public static') and 'void main(' in line:
-                    if next(lines).lstrip() == PSVMAIN_DESCRIPTOR:
-                        return file.stem
 
-
-    def read_compiled(self, path, isolator) -> list[tuple[str, bytes]] | None:
+    def read_compiled(self, path, isolator) -> list[CompiledFile] | None:
         # in case of multiple or nested classes, multiple .class files are
         # generated by javac
         classes = list(isolator.path.glob('*.class'))
 
-        # files: list of tuples (filename, filedata as bytes)
-        files = [(file.name, file.open('rb').read()) for file in classes]
+        # files: list of tuples (filename, path)
+        files = [(file.name, file) for file in classes]
 
         if not self.found_public:
-            # the main() may be anywhere, so run javap(1) on all .class
-            new_class_name = self.find_class_having_main(classes)
+            # the main() may be anywhere, so look into all .class
+            new_class_name = self.find_class_having_main(files)
             if new_class_name:
                 self.class_name = new_class_name
 
         return files
 
 
-    def write_binary(self, path, binary):
-        # see read_compiled(), we need to write back all .class files
-        # but give only the main class name (execute_filename()) to java(1)
-        for file, data in binary:
-            with (path / file).open('wb') as c:
-                c.write(data)
-        return path / self.execute_filename()
-
-
 class Java(LangDefinition):
     source_ext = '.java'
     compiler = Program('javac', opts=['-encoding', 'UTF-8'],
@@ -183,7 +307,5 @@ class Java(LangDefinition):
     # /usr/lib/jvm/java-8-openjdk/jre/lib/amd64/jvm.cfg links to
     # /etc/java-8-openjdk/amd64/jvm.cfg
     allowed_dirs = ['/etc']
-    # ensure we can parse the javac(1) stderr
-    extra_binaries = {'disassembler': Program('javap', version_opt='-version')}
     reference_source = reference
     executer = JavaExecution
\ No newline at end of file
@@ -17,20 +17,31 @@
 # You should have received a copy of the GNU General Public License
 # along with Prologin-SADM.  If not, see <http://www.gnu.org/licenses/>.
 
-import functools
+import asyncio
+import contextlib
+import hashlib
 import logging
 import os
 import re
+import shutil
 import subprocess
 import tempfile
 import warnings
 from pathlib import Path
-from typing import Dict, List, Optional, Type
+from typing import Callable, Dict, List, Optional, Type
 
+import camisole.artifacts
+import camisole.blobs
+import camisole.cache
 import camisole.isolate
+import camisole.judge
 import camisole.utils
 from camisole.conf import conf
 
+# where the files given to checkers are mounted in their boxes
+CHECKER_OUTPUT = '/output'
+CHECKER_EXPECTED = '/expected'
+
 
 class Program:
     def __init__(self, cmd, *, 
@@ -48,17 +59,32 @@ class Program:
         self.version_opt = version_opt
         self.version_lines = version_lines
         self.version_regex = re.compile(version_regex)
+        # output of the version command, run once
+        self.version_output: Optional[str] = None
 
-    @functools.lru_cache()
     def _version(self):
         if self.version_opt is None:  # noqa
             return None
 
-        proc = subprocess.run([self.cmd, self.version_opt],
-            stderr=subprocess.STDOUT, stdout=subprocess.PIPE
-        )
+        if self.version_output is None:
+            proc = subprocess.run([self.cmd, self.version_opt],
+                stderr=subprocess.STDOUT, stdout=subprocess.PIPE
+            )
+            self.version_output = proc.stdout.decode().strip()
+
+        return self.version_output
 
-        return proc.stdout.decode().strip()
+    async def probe_version(self):
+        """Same as _version(), without blocking the event loop."""
+        if self.version_opt is None:
+            return None
+
+        proc = await asyncio.create_subprocess_exec(
+            self.cmd, self.version_opt,
+            stderr=asyncio.subprocess.STDOUT, stdout=asyncio.subprocess.PIPE)
+        stdout, _ = await proc.communicate()
+        self.version_output = stdout.decode().strip()
+        return self.version_output
 
     def version(self):
         if self.version_opt is None:  # noqa
@@ -141,12 +167,15 @@ class LangDefinition:
         return {p.cmd_name: {'version': p.version(), 'opts': p.opts}
                 for p in cls.required_binaries()}
 
-BinaryNamedFile = tuple[str, bytes]
+CompiledFile = tuple[str, Path]
 
 class LangExecution:
     opts: dict
     df: Type[LangDefinition]
     
+    # attributes set by compile() that execute() depends on
+    compile_state: tuple = ()
+
     _registry: Dict[str, Type['LangExecution']] = {}
     _definition_registry: Dict[str, Type[LangDefinition]] = {}
     
@@ -204,6 +233,14 @@ class LangExecution:
         yield from cls.df.required_binaries()
 
 
+    @classmethod
+    async def setup(cls):
+        """
+        Prepare what the language shares between all its executions (eg.
+        caches), once, when the server starts.
+        """
+
+
     def __init__(self, opts: dict):
         name = opts.get('lang', self.df.name)
         
@@ -211,6 +248,12 @@ class LangExecution:
             raise ValueError(f"language {name} not found")
 
         self.opts = opts
+        # names of the box entries to keep between tests in single-box mode
+        self.box_baseline: Optional[set] = None
+        # (execution, binary) of the checker judging the outputs, if any
+        self.checker: Optional[tuple] = None
+        # called with the parts of the result as soon as they are known
+        self.report: Optional[Callable[[str, dict], None]] = None
 
 
     def __repr__(self):
@@ -223,7 +266,25 @@ class LangExecution:
             )
 
 
-    async def compile(self):
+    @contextlib.asynccontextmanager
+    async def sandbox(self, opts, allowed_dirs, isolator=None):
+        """
+        Yield a fresh isolator configured with the given limits and allowed
+        directories, or reconfigure an existing one (single-box mode).
+        """
+        if isolator is None:
+            isolator = camisole.isolate.Isolator(
+                opts, allowed_dirs=allowed_dirs)
+
+            async with isolator:
+                yield isolator
+        else:
+            isolator.opts = opts
+            isolator.allowed_dirs = allowed_dirs
+            yield isolator
+
+
+    async def compile(self, isolator=None):
         if not self.df.compiler:
             raise RuntimeError("no compiler")
 
@@ -232,11 +293,12 @@ class LangExecution:
         os.chmod(root_tmp.name, 0o777)
         tmparg = [f'/tmp={root_tmp.name}:rw']
 
-        isolator = camisole.isolate.Isolator(
+        sandbox = self.sandbox(
             self.opts.get('compile', {}),
-            allowed_dirs=self.get_allowed_dirs() + tmparg)
+            self.compile_allowed_dirs() + tmparg,
+            isolator)
 
-        async with isolator:
+        async with sandbox as isolator:
             assert isolator.path is not None
 
             wd = Path(isolator.path)
@@ -250,51 +312,294 @@ class LangExecution:
 
             cmd = self.compile_command(str(source), str(compiled))
 
-            await isolator.run(cmd, env={**env, **self.df.compiler.env})
+            await isolator.run(cmd, env={**env, **self.compile_env()})
 
-            binary = self.read_compiled(str(compiled), isolator)
+            files = self.read_compiled(str(compiled), isolator)
+            binary = None
 
-            if binary is not None:
-                binary = binary[1]
+            # the output of failed compilations is of no use
+            if files and isolator.isolate_retcode == 0:
+                try:
+                    binary = camisole.artifacts.artifact_store() \
+                        .put_files(files)
+                except (FileNotFoundError, PermissionError):
+                    pass
 
         root_tmp.cleanup()
 
         return (isolator.isolate_retcode, isolator.info, binary)
 
 
-    async def execute(self, binary, opts=None):
+    def compile_cache_key(self):
+        source = camisole.utils.force_bytes(self.opts.get('source', ''))
+
+        return camisole.cache.digest(
+            self.df.name,
+            f'{type(self).__module__}.{type(self).__qualname__}',
+            [[p.cmd, p.version(), p.opts, p.env]
+             for p in self.required_binaries()],
+            self.opts.get('compile', {}),
+            hashlib.sha256(source).hexdigest(),
+        )
+
+
+    async def cached_compile(self, isolator=None):
+        """
+        :meth:`compile`, going through the compile cache. Only deterministic
+        outcomes (success or compilation errors) are cached. Identical
+        compilations running at the same time are only done once.
+        """
+        cache = camisole.cache.compile_cache()
+        key = self.compile_cache_key()
+
+        if cache is not None:
+            hit = cache.get(key)
+            if hit is not None:
+                _, _, binary, _ = hit
+                if binary is None or binary.exists():
+                    return self.restore_compiled(hit)
+                # the compiled files were evicted from the artifact store
+                cache.discard(key)
+
+        async def compile():
+            retcode, info, binary = await self.compile(isolator)
+            state = {attr: getattr(self, attr) for attr in self.compile_state}
+            compiled = (retcode, info, binary, state)
+
+            if cache is not None and \
+                    info['meta']['status'] in ('OK', 'RUNTIME_ERROR'):
+                cache.put(key, compiled)
+
+            return compiled
+
+        return self.restore_compiled(
+            await camisole.cache.compilations.do(key, compile))
+
+
+    def restore_compiled(self, compiled):
+        retcode, info, binary, state = compiled
+
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
+        return (retcode, info, binary)
+
+
+    async def execute(self, binary, opts=None, isolator=None):
         if opts is None:
             opts = {}
 
-        opts = {**self.opts.get('execute', {}), **opts}
-        input_data = None
+        defaults = self.opts.get('execute', {})
+        for name in ('stdin', 'expected'):
+            if opts.get(name) or opts.get(f'{name}_ref'):
+                # a test blob replaces the default one, whatever its kind
+                defaults = {k: v for k, v in defaults.items()
+                            if k not in (name, f'{name}_ref')}
+
+        opts = {**defaults, **opts}
+        allowed_dirs = self.get_allowed_dirs()
+        # entered before resolving the refs, so that their pins are released
+        # if a later one fails
+        with contextlib.ExitStack() as pins:
+            stdin = None
+
+            key = self.blob_option(opts, 'stdin', pins)
+            if key is not None:
+                # the input is given to isolate as a file, from a directory
+                # mounted read-only, and shared by the tests using the same
+                # input
+                allowed_dirs.append(f'{camisole.blobs.MOUNT_POINT}='
+                                    f'{camisole.blobs.blob_store().path(key)}')
+                stdin = (f'{camisole.blobs.MOUNT_POINT}/'
+                         f'{camisole.blobs.FILENAME}')
+
+            expected = None
+            if opts.get('judge', True):
+                expected = self.blob_option(opts, 'expected', pins)
+
+            output = None
+            if expected is not None and self.checker is not None:
+                # the checker runs in its own box, once this one is released
+                output = Path(pins.enter_context(
+                    tempfile.TemporaryDirectory(prefix='camisole-output-')))
+                output.chmod(0o755)
+
+            mount = (isinstance(binary, camisole.artifacts.Artifact) and
+                     self.box_baseline is None and
+                     conf['artifact-store']['mount'])
+
+            if mount:
+                allowed_dirs.append(
+                    f'{camisole.artifacts.MOUNT_POINT}={binary.path}')
+
+            sandbox = self.sandbox(opts, allowed_dirs, isolator)
+
+            async with sandbox as isolator:
+                assert isolator.path is not None
+
+                wd = Path(isolator.path)
+                env = {'HOME': self.filter_box_prefix(str(wd))}
+
+                if self.box_baseline is not None:
+                    # single-box mode: the binary is already there
+                    self.reset_box(wd)
+                    compiled = wd / self.execute_filename()
+                elif mount:
+                    compiled = Path(camisole.artifacts.MOUNT_POINT,
+                                    self.execute_filename())
+                else:
+                    compiled = self.write_binary(wd, binary)
+
+                env = {**env, **(self.df.interpreter.env if self.df.interpreter else {})}
+
+                await isolator.run(
+                                    self.execute_command(str(compiled)),
+                                    env=env, stdin=stdin,
+                                    read_stdout=expected is None
+                                )
+
+                if expected is not None:
+                    # the output is judged instead of being returned
+                    del isolator.info['stdout']
+
+                if output is not None:
+                    camisole.artifacts.clone_file(
+                        wd / isolator.stdout_file, output / 'output')
+                    (output / 'output').chmod(0o644)
+                elif expected is not None:
+                    # 0 asks for an exact comparison of the numbers
+                    tolerance = opts.get('judge_tolerance')
+                    if tolerance is None:
+                        tolerance = camisole.judge.DEFAULT_TOLERANCE
+
+                    isolator.info['judge'] = camisole.judge.judge(
+                        wd / isolator.stdout_file,
+                        camisole.blobs.blob_store().blob_path(expected),
+                        opts.get('judge_mode') or 'exact', tolerance)
+
+            if output is not None:
+                checker, checker_binary = self.checker
+                isolator.info['judge'] = await checker.check(
+                    checker_binary, key, output, expected)
 
-        if 'stdin' in opts and opts['stdin']:
-            input_data = camisole.utils.force_bytes(opts['stdin'])
+        return (isolator.isolate_retcode, isolator.info)
 
-        isolator = camisole.isolate.Isolator(
-            opts, allowed_dirs=self.get_allowed_dirs())
 
-        async with isolator:
+    async def check(self, binary, stdin, output, expected):
+        """
+        Run this program as the checker of a test. It is given the paths of
+        the test input, the program output and the expected output, and
+        accepts the output by exiting with 0.
+        """
+        store = camisole.blobs.blob_store()
+        allowed_dirs = self.get_allowed_dirs() + [
+            f'{CHECKER_OUTPUT}={output}',
+            f'{CHECKER_EXPECTED}={store.path(expected)}',
+        ]
+        args = [
+            '/dev/null',
+            f'{CHECKER_OUTPUT}/output',
+            f'{CHECKER_EXPECTED}/{camisole.blobs.FILENAME}',
+        ]
+
+        if stdin is not None:
+            allowed_dirs.append(
+                f'{camisole.blobs.MOUNT_POINT}={store.path(stdin)}')
+            args[0] = f'{camisole.blobs.MOUNT_POINT}/{camisole.blobs.FILENAME}'
+
+        mount = (isinstance(binary, camisole.artifacts.Artifact) and
+                 conf['artifact-store']['mount'])
+
+        if mount:
+            allowed_dirs.append(
+                f'{camisole.artifacts.MOUNT_POINT}={binary.path}')
+
+        sandbox = self.sandbox(self.opts.get('execute', {}), allowed_dirs)
+
+        async with sandbox as isolator:
             assert isolator.path is not None
 
-            wd = isolator.path
+            wd = Path(isolator.path)
             env = {'HOME': self.filter_box_prefix(str(wd))}
-            compiled = self.write_binary(Path(wd), binary)
+
+            if mount:
+                compiled = Path(camisole.artifacts.MOUNT_POINT,
+                                self.execute_filename())
+            else:
+                compiled = self.write_binary(wd, binary)
 
             env = {**env, **(self.df.interpreter.env if self.df.interpreter else {})}
 
-            await isolator.run(
-                                self.execute_command(str(compiled)),
-                                env=env, data=input_data
-                            )
+            await isolator.run(self.execute_command(str(compiled)) + args,
+                               env=env)
 
-        return (isolator.isolate_retcode, isolator.info)
+        status = isolator.info['meta']['status']
+        if status == 'OK':
+            verdict = 'OK'
+        elif status == 'RUNTIME_ERROR':
+            verdict = 'WRONG_ANSWER'
+        else:
+            # eg. the checker timed out
+            verdict = 'CHECKER_ERROR'
+
+        return {'verdict': verdict, 'mode': 'checker',
+                'checker': isolator.info}
+
+
+    async def compile_checker(self, result):
+        """
+        Compile the checker of the outputs, through the compile cache so that
+        it is only compiled once for all the programs it checks.
+        """
+        opts = self.opts['checker']
+        name = opts['lang'].lower()
+
+        if name not in self._registry:
+            raise ValueError(f"language {name} not found")
+
+        checker = self._registry[name]({**opts, 'lang': name})
+        result['checker'] = {}
+        binary = await checker.run_compilation(result['checker'])
+
+        if not result['checker']:
+            # interpreted checker
+            del result['checker']
+
+        if not binary:
+            return None
+
+        return checker, binary
 
 
-    async def run_compilation(self, result):
+    @staticmethod
+    def blob_option(opts, name, pins):
+        """
+        Key of the blob given inline as ``name`` or uploaded beforehand and
+        referenced as ``name_ref``, pinned until ``pins`` is closed.
+        """
+        store = camisole.blobs.blob_store()
+
+        if opts.get(f'{name}_ref'):
+            key = opts[f'{name}_ref']
+        elif opts.get(name):
+            key = store.put(camisole.utils.force_bytes(opts[name]))
+        else:
+            return None
+
+        try:
+            if store.get(key) is None:
+                raise FileNotFoundError(key)
+            pins.enter_context(store.pinned(key))
+        except FileNotFoundError:
+            # maybe evicted by another process in the meantime
+            raise RuntimeError(f"unknown blob {key}") from None
+
+        return key
+
+
+    async def run_compilation(self, result, isolator=None):
         if self.df.compiler is not None:
-            cretcode, info, binary = await self.compile()
+            cretcode, info, binary = await self.cached_compile(isolator)
             result['compile'] = info
 
             if cretcode != 0:
@@ -312,40 +617,179 @@ class LangExecution:
         return binary
 
 
-    async def run_tests(self, binary, result):
+    def parallelism(self, isolator=None):
+        if isolator is not None:
+            # tests sharing a box can only run one at a time
+            return 1
+
+        limit = conf['test-parallelism']
+        return max(1, min(self.opts.get('parallelism') or limit, limit))
+
+
+    async def run_tests(self, binary, result, isolator=None):
         tests = self.opts.get('tests', [{}])
 
         if tests:
             result['tests'] = [{}] * len(tests)
 
-        for i, test in enumerate(tests):
-            retcode, info = await self.execute(binary, test)
+        semaphore = asyncio.Semaphore(self.parallelism(isolator))
+        # index of the first fatal failure; later tests are not run
+        stop = len(tests)
+        # fatal tests not finished yet: the later tests may be left out of
+        # the result, so their events are held until then
+        unsettled = {i for i, test in enumerate(tests)
+                     if test.get('fatal', False) or
+                     self.opts.get('all_fatal', False)}
+        held = {}
+
+        def settle(i, info):
+            unsettled.discard(i)
+            held[i] = info
+            first_unsettled = min(unsettled, default=len(tests))
+
+            for j in sorted(held):
+                if j > stop:
+                    # left out of the result
+                    del held[j]
+                elif j < first_unsettled:
+                    self.notify('test', {'index': j, 'test': held.pop(j)})
+
+        async def run_test(i, test):
+            nonlocal stop
+
+            async with semaphore:
+                if i > stop:
+                    return None
+
+                retcode, info = await self.execute(binary, test, isolator)
+
+                if retcode != 0 and i < stop and (
+                        test.get('fatal', False) or
+                        self.opts.get('all_fatal', False)
+                    ):
+                    stop = i
+                    for task in tasks[i + 1:]:
+                        task.cancel()
+
+            settle(i, {
+                'name': test.get('name', 'test{:03d}'.format(i)),
+                **info
+            })
+            return info
+
+        tasks = [asyncio.ensure_future(run_test(i, test))
+                 for i, test in enumerate(tests)]
+
+        try:
+            if tasks:
+                # stop everything as soon as a test crashes
+                done, pending = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_EXCEPTION)
+                if pending:
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.wait(pending)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        for i, (test, task) in enumerate(zip(tests, tasks)):
+            if task.cancelled() or i > stop:
+                continue
+
+            info = task.result()
 
             assert info is not None
-            
+
             result['tests'][i] = {
                 'name': test.get('name', 'test{:03d}'.format(i)),
                 **info
             }
 
-            if retcode != 0 and (
-                    test.get('fatal', False) or
-                    self.opts.get('all_fatal', False)
-                ):
-                break
-
 
     async def run(self):
         result = {}
-        binary = await self.run_compilation(result)
 
-        if not binary:
-            return result
+        if self.opts.get('checker'):
+            self.checker = await self.compile_checker(result)
 
-        await self.run_tests(binary, result)
+            if 'checker' in result:
+                self.notify('checker', {'checker': result['checker']})
+
+            if self.checker is None:
+                return result
+
+        _, checker_binary = self.checker or (None, None)
+
+        with camisole.artifacts.pinned(checker_binary):
+            if self.opts.get('single_box', conf['single-box']):
+                return await self.run_single_box(result)
+
+            binary = await self.run_compilation(result)
+            self.notify_compilation(result)
+
+            if not binary:
+                return result
+
+            with camisole.artifacts.pinned(binary):
+                await self.run_tests(binary, result)
     
         return result
 
+
+    async def run_single_box(self, result):
+        """
+        Compile and run every test in the same box, which is initialized and
+        cleaned up only once. Between two tests, everything that was not in
+        the box right after compilation is removed.
+        """
+        async with camisole.isolate.Isolator({}) as isolator:
+            assert isolator.path is not None
+
+            binary = await self.run_compilation(result, isolator)
+            self.notify_compilation(result)
+
+            if not binary:
+                return result
+
+            wd = Path(isolator.path)
+
+            if not (wd / self.execute_filename()).exists():
+                # interpreted languages, or compiled in another box
+                self.write_binary(wd, binary)
+
+            self.box_baseline = {p.name for p in wd.iterdir()}
+
+            try:
+                with camisole.artifacts.pinned(binary):
+                    await self.run_tests(binary, result, isolator)
+            finally:
+                self.box_baseline = None
+
+        return result
+
+
+    def notify(self, event, payload):
+        if self.report is not None:
+            self.report(event, payload)
+
+
+    def notify_compilation(self, result):
+        if 'compile' in result:
+            self.notify('compile', {'compile': result['compile']})
+
+
+    def reset_box(self, path):
+        for entry in path.iterdir():
+            if entry.name in self.box_baseline:
+                continue
+
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+
+
     def get_allowed_dirs(self):
         allowed_dirs = []
         allowed_dirs += self.df.allowed_dirs
@@ -358,22 +802,34 @@ class LangExecution:
         return ['-o', output]
 
 
-    def read_compiled(self, path, isolator) -> list[BinaryNamedFile] | None:
-        try:
-            with Path(path).open('rb') as c:
-                return [("", c.read())]
-        except (FileNotFoundError, PermissionError):
-            pass
+    def compile_allowed_dirs(self):
+        return self.get_allowed_dirs()
+
+
+    def compile_env(self):
+        return self.df.compiler.env
+
+
+    def read_compiled(self, path, isolator) -> list[CompiledFile] | None:
+        path = Path(path)
+
+        if path.is_file():
+            return [(path.name, path)]
 
 
     def write_binary(self, path, binary):
-        compiled = path / self.execute_filename()
-        
-        with compiled.open('wb') as c:
-            c.write(binary)
+        if isinstance(binary, camisole.utils.bytes_like):
+            # source of interpreted languages
+            compiled = path / self.execute_filename()
+            compiled.write_bytes(binary)
+            compiled.chmod(0o700)
+        else:
+            for name, source in binary.files():
+                compiled = path / name
+                camisole.artifacts.clone_file(source, compiled)
+                compiled.chmod(0o700)
 
-        compiled.chmod(0o700)
-        return compiled
+        return path / self.execute_filename()
 
 
     def source_filename(self):
@@ -438,7 +894,8 @@ class PipelineLang(LangExecution):
             yield from lang_cls.required_binaries()
 
 
-    async def run_compilation(self, result):
+    async def run_compilation(self, result, isolator=None):
+        # stages are compiled in their own boxes
         source = camisole.utils.force_bytes(self.opts.get('source', ''))
         binary = None
 
@@ -447,7 +904,7 @@ class PipelineLang(LangExecution):
 
             lang = lang_cls.executer({**self.opts, 'source': source})
 
-            cretcode, info, binary = await lang.compile()
+            cretcode, info, binary = await lang.cached_compile()
             result['compile'] = info
 
             if cretcode != 0:
@@ -461,10 +918,11 @@ class PipelineLang(LangExecution):
                 return
 
             # compile output is next stage input
-            source = binary
+            (_, compiled), = binary.files()
+            source = compiled.read_bytes()
 
         return binary
 
 
-    async def compile(self):
+    async def compile(self, isolator=None):
         raise NotImplementedError()
@@ -2,9 +2,13 @@ import logging
 
 
 def handle(args):
+    from camisole.conf import conf
     from camisole.httpserver import run
     from camisole.languages import all
 
+    if args.workers is not None:
+        conf.merge({'workers': args.workers})
+
     logging.info(
         "Registry has %d languages:\n%s", 
         len(all()),
@@ -21,6 +25,9 @@ def build(parser):
 
     p.add_argument('-h', '--host', default='0.0.0.0')
     p.add_argument('-p', '--port', type=int, default=42920)
+    p.add_argument('-w', '--workers', type=int,
+                   help="number of server processes (overrides the "
+                        "configuration)")
     p.add_argument('--help', action='help')
 
     return 'serve', handle
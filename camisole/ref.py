@@ -1,3 +1,7 @@
+import asyncio
+import time
+from typing import Dict, Tuple
+
 import camisole.languages
 
 
@@ -5,7 +9,9 @@ async def test(lang_name, **kw):
     expected = b'42\n'
 
     lang_cls = camisole.languages.by_name(lang_name)
-    lang = lang_cls({'source': lang_cls.reference_source, 'tests': [{}], **kw})
+    lang = lang_cls.executer({'lang': lang_name.lower(),
+                              'source': lang_cls.reference_source,
+                              'tests': [{}], **kw})
     raw_result = await lang.run()
 
     try:
@@ -15,3 +21,52 @@ async def test(lang_name, **kw):
         return False, raw_result
     except (KeyError, IndexError, ValueError):
         return False, raw_result
+
+
+class TestResults:
+    """
+    Results of the reference programs of the languages, kept for ``ttl``
+    seconds, at most ``parallelism`` of them running at the same time.
+    Concurrent requests for the same language share the same run.
+    """
+
+    def __init__(self, ttl: float, parallelism: int):
+        self.ttl = ttl
+        self.semaphore = asyncio.Semaphore(parallelism)
+        # language name -> (time of the result, success, raw result)
+        self.results: Dict[str, Tuple[float, bool, dict]] = {}
+        self.running: Dict[str, asyncio.Future] = {}
+
+    def __repr__(self):
+        return (f"<TestResults {len(self.results)} cached, "
+                f"{len(self.running)} running>")
+
+    async def get(self, lang_name: str,
+                  refresh: bool = False) -> Tuple[bool, dict]:
+        """Result of ``test(lang_name)``, run again if stale or ``refresh``."""
+        cached = self.results.get(lang_name)
+
+        if not refresh and cached is not None and \
+                cached[0] + self.ttl > time.monotonic():
+            return cached[1:]
+
+        if lang_name not in self.running:
+            self.running[lang_name] = asyncio.ensure_future(
+                self._run(lang_name))
+
+        # another request may be waiting for the same run
+        return await asyncio.shield(self.running[lang_name])
+
+    async def _run(self, lang_name: str) -> Tuple[bool, dict]:
+        try:
+            async with self.semaphore:
+                success, raw = await test(lang_name)
+        finally:
+            del self.running[lang_name]
+
+        self.results[lang_name] = (time.monotonic(), success, raw)
+        return success, raw
+
+    def cancel_all(self) -> None:
+        for task in self.running.values():
+            task.cancel()
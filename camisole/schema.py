@@ -1,3 +1,8 @@
+import reprlib
+
+import camisole.blobs
+
+
 class ValidationError(ValueError):
     def __init__(self, path, msg):
         self.path = path
@@ -28,6 +33,18 @@ class Union:
         return f"Union[{self.wrapped}]"
 
 
+class Constrained:
+    """Of the wrapped schema, and satisfying a predicate."""
+
+    def __init__(self, wrapped, predicate, description):
+        self.wrapped = wrapped
+        self.predicate = predicate
+        self.description = description
+
+    def __repr__(self):
+        return f"Constrained[{self.wrapped}, {self.description}]"
+
+
 def human_type_name(cls):
     return {
         bytes: "binary data",
@@ -37,77 +54,190 @@ def human_type_name(cls):
     }.get(cls, f"a {cls.__name__}")
 
 
-def validate_schema(obj, schema: dict) -> None:
-    """ Validate that obj matches a given schema. Raises ValidationError if not.
+class _Invalid(Exception):
+    """Validation failure, collecting its path on the way up."""
 
-    Args:
-        obj(object): object to validate
-        schema (dict): schema to validate against
+    def __init__(self, msg):
+        self.msg = msg
+        # innermost part first
+        self.path = []
 
-    Raises:
-        ValidationError: if obj does not match the schema, with a message describing the error
-    """
 
+def _compile(schema):
     htn = human_type_name
 
-    def explore(obj, schema, path):
-        if isinstance(schema, O):
-            if obj is None:
-                return
-            explore(obj, schema.wrapped, path)
+    if isinstance(schema, O):
+        if isinstance(schema.wrapped, type):
+            # fast path for the most common case
+            cls = schema.wrapped
 
-        elif isinstance(schema, Union):
-            for subtype in schema.wrapped:
+            def optional_instance(obj):
+                if obj is not None and not isinstance(obj, cls):
+                    raise _Invalid(
+                        f"expected {htn(cls)}, got {htn(obj.__class__)}")
+
+            return optional_instance
+
+        check = _compile(schema.wrapped)
+
+        def optional(obj):
+            if obj is not None:
+                check(obj)
+
+        return optional
+
+    elif isinstance(schema, Union):
+        expected = ' or '.join(htn(s) for s in schema.wrapped)
+
+        if all(isinstance(s, type) for s in schema.wrapped):
+            classes = tuple(schema.wrapped)
+
+            def union_instance(obj):
+                if not isinstance(obj, classes):
+                    raise _Invalid(
+                        f"expected {expected}, got {htn(obj.__class__)}")
+
+            return union_instance
+
+        checks = [_compile(s) for s in schema.wrapped]
+
+        def union(obj):
+            for check in checks:
                 try:
-                    explore(obj, subtype, path)
+                    check(obj)
                     # one of the types is OK, early stop
                     return
-                except ValidationError:
+                except _Invalid:
                     pass
-            expected = ' or '.join(htn(s) for s in schema.wrapped)
-            raise ValidationError(
-                path, f"expected {expected}, got {htn(obj.__class__)}")
+            raise _Invalid(f"expected {expected}, got {htn(obj.__class__)}")
+
+        return union
+
+    elif isinstance(schema, Constrained):
+        check = _compile(schema.wrapped)
+        predicate = schema.predicate
+        description = schema.description
+
+        def constrained(obj):
+            check(obj)
+            if not predicate(obj):
+                raise _Invalid(
+                    f"expected {description}, got {reprlib.repr(obj)}")
+
+        return constrained
 
-        elif isinstance(schema, list):
-            subtype, = schema
+    elif isinstance(schema, list):
+        subtype, = schema
+        check = _compile(subtype)
+
+        def list_of(obj):
             try:
-                for i, item in enumerate(obj):
-                    explore(item, subtype, f'{path}[{i}]')
+                items = enumerate(obj)
             except TypeError:
-                raise ValidationError(
-                    path, f"expected a list, got {htn(obj.__class__)}")
+                raise _Invalid(
+                    f"expected a list, got {htn(obj.__class__)}") from None
+
+            for i, item in items:
+                try:
+                    check(item)
+                except _Invalid as e:
+                    e.path.append(f'[{i}]')
+                    raise
+
+        return list_of
 
-        elif isinstance(schema, tuple):
+    elif isinstance(schema, tuple):
+        checks = [_compile(s) for s in schema]
+
+        def tuple_of(obj):
             try:
-                for i, item in enumerate(obj):
-                    explore(item, schema[i], f'{path}[{i}]')
+                items = enumerate(obj)
             except TypeError:
-                raise ValidationError(
-                    path, f"expected a list, got {htn(obj.__class__)}")
+                raise _Invalid(
+                    f"expected a list, got {htn(obj.__class__)}") from None
 
-        elif isinstance(schema, dict):
-            try:
-                for key, subtype in schema.items():
-                    explore(obj.get(key), subtype, f'{path}.{key}')
-            except ValidationError:
-                raise
-            except Exception:
-                raise ValidationError(
-                    path, f"expected a mapping, got {htn(obj.__class__)}")
+            for i, item in items:
+                try:
+                    checks[i](item)
+                except _Invalid as e:
+                    e.path.append(f'[{i}]')
+                    raise
+
+        return tuple_of
+
+    elif isinstance(schema, dict):
+        checks = [(key, f'.{key}', _compile(subtype))
+                  for key, subtype in schema.items()]
+
+        def mapping(obj):
+            for key, path, check in checks:
+                try:
+                    value = obj.get(key)
+                except Exception:
+                    raise _Invalid(
+                        f"expected a mapping, got {htn(obj.__class__)}"
+                    ) from None
+
+                try:
+                    check(value)
+                except _Invalid as e:
+                    e.path.append(path)
+                    raise
 
-        elif not isinstance(obj, schema):
-            raise ValidationError(
-                path, f"expected {htn(schema)}, got {htn(obj.__class__)}")
+        return mapping
 
-    explore(obj, schema, '')
+    def instance(obj):
+        if not isinstance(obj, schema):
+            raise _Invalid(
+                f"expected {htn(schema)}, got {htn(obj.__class__)}")
+
+    return instance
+
+
+def compile_schema(schema):
+    """ Compile a schema into a validator function, that raises
+    ValidationError if its argument does not match the schema.
+
+    The schema is only walked once, here: the validator is made of closures
+    specialized for each part of the schema, and paths are only built when
+    the validation fails.
+    """
+    check = _compile(schema)
+
+    def validate(obj):
+        try:
+            check(obj)
+        except _Invalid as e:
+            raise ValidationError(''.join(reversed(e.path)), e.msg) from None
+
+    return validate
+
+
+def validate_schema(obj, schema: dict) -> None:
+    """ Validate that obj matches a given schema. Raises ValidationError if not.
+
+    Args:
+        obj(object): object to validate
+        schema (dict): schema to validate against
+
+    Raises:
+        ValidationError: if obj does not match the schema, with a message describing the error
+    """
+    compile_schema(schema)(obj)
 
 
 str_bytes = Union(str, bytes)
 number = Union(float, int)
+non_negative_int = Constrained(int, lambda n: n >= 0,
+                               "a non-negative integer")
+# same keys as the /blobs/<sha256> routes
+blob_key = Constrained(str, camisole.blobs.RE_KEY.fullmatch,
+                       "a SHA-256 hexadecimal digest")
 
 ISOLATE_OPTS_PROPERTIES = {
     'fsize': O(int),
     'mem': O(int),
+    'output-limit': O(non_negative_int),
     'processes': O(int),
     'quota': O(str),
     'stack': O(int),
@@ -118,14 +248,29 @@ ISOLATE_OPTS_PROPERTIES = {
 
 EXECUTE_PROPERTIES = {
     'stdin': O(str_bytes),
+    'stdin_ref': O(blob_key),
+    'expected': O(str_bytes),
+    'expected_ref': O(blob_key),
     'judge': O(bool),
+    'judge_mode': O(str),
+    'judge_tolerance': O(number),
     **ISOLATE_OPTS_PROPERTIES,
 }
 
+CHECKER_SCHEMA = {
+    'lang': str,
+    'source': str_bytes,
+    'compile': O(ISOLATE_OPTS_PROPERTIES),
+    'execute': O(ISOLATE_OPTS_PROPERTIES),
+}
+
 RUN_SCHEMA = {
     'lang': str,
     'source': str_bytes,
+    'checker': O(CHECKER_SCHEMA),
     'all_fatal': O(bool),
+    'single_box': O(bool),
+    'parallelism': O(int),
     'compile': O(ISOLATE_OPTS_PROPERTIES),
     'execute': O(EXECUTE_PROPERTIES),
     'tests': O([{
@@ -135,6 +280,11 @@ RUN_SCHEMA = {
     }]),
 }
 
+BATCH_SCHEMA = {
+    # each submission is validated as a run, once merged with the other fields
+    'submissions': [dict],
+}
+
 
-def validate_run(json):
-    validate_schema(json, RUN_SCHEMA)
+validate_run = compile_schema(RUN_SCHEMA)
+validate_batch = compile_schema(BATCH_SCHEMA)
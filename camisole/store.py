@@ -0,0 +1,245 @@
+import collections
+import contextlib
+import errno
+import fcntl
+import logging
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+RE_KEY = re.compile(r'[0-9a-f]+')
+
+
+def entry_size(path: Path) -> int:
+    if path.is_dir() and not path.is_symlink():
+        return sum(p.lstat().st_size for p in path.rglob('*'))
+
+    return path.lstat().st_size
+
+
+def remove_entry(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class DiskStore:
+    """
+    Size-bounded directory of entries (files or directories) addressed by a
+    hexadecimal key, evicting the least recently used entries once the total
+    size exceeds ``max_size`` bytes.
+
+    Entries are added atomically (written aside, then renamed), so a reader
+    never sees a partial entry. Pinned entries are never evicted.
+
+    Several processes can share a store: entries added by the others are
+    picked up when looked up, and each process has its own scratch directory.
+    Pins are shared flock(2) locks on the entries, so that the other
+    processes don't evict them either.
+    """
+
+    def __init__(self, root, max_size: int):
+        self.root = Path(root).expanduser()
+        self.max_size = max_size
+        self.tmp_root = self.root / 'tmp'
+        self.tmp = self.tmp_root / str(os.getpid())
+        self.pins: collections.Counter[str] = collections.Counter()
+        # key -> file descriptor of the pinned entry, holding its lock
+        self.pin_fds: dict[str, int] = {}
+        # key -> size, least recently used first
+        self.entries: collections.OrderedDict[str, int] = \
+            collections.OrderedDict()
+        self.size = 0
+
+        self.tmp_root.mkdir(parents=True, exist_ok=True)
+        self._clean_tmp()
+        self.tmp.mkdir()
+        self._scan()
+
+    def __repr__(self):
+        return (f"<{type(self).__name__} {self.root} {len(self.entries)} entries, "
+                f"{self.size}/{self.max_size} bytes>")
+
+    def _clean_tmp(self):
+        # scratch directories of this process or of dead ones
+        for tmp in self.tmp_root.iterdir():
+            try:
+                pid = int(tmp.name)
+                if pid != os.getpid():
+                    os.kill(pid, 0)
+                    continue
+            except (ValueError, ProcessLookupError):
+                pass
+            except PermissionError:
+                # alive, but not ours
+                continue
+
+            remove_entry(tmp)
+
+    def _scan(self):
+        found = []
+        for shard in self.root.iterdir():
+            if shard == self.tmp_root or not shard.is_dir():
+                continue
+            for path in shard.iterdir():
+                found.append((path.lstat().st_mtime, path.name,
+                              entry_size(path)))
+
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+
+    def path(self, key: str) -> Path:
+        # keys often come from clients: don't let them escape the store
+        if not RE_KEY.fullmatch(key):
+            raise ValueError(f"invalid key {key!r}")
+
+        return self.root / key[:2] / key
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self.path(key)
+
+        if key not in self.entries:
+            # maybe added by another process
+            try:
+                size = entry_size(path)
+            except FileNotFoundError:
+                return None
+
+            self.entries[key] = size
+            self.size += size
+            self.evict()
+            if key not in self.entries:
+                return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # removed behind our back
+            self.size -= self.entries.pop(key)
+            return None
+
+        self.entries.move_to_end(key)
+        return path
+
+    def mkdtemp(self) -> Path:
+        """Scratch directory on the same filesystem as the store."""
+        return Path(tempfile.mkdtemp(dir=self.tmp))
+
+    def put_path(self, key: str, src: Path) -> Path:
+        """Move a file or directory to the store, replacing any entry."""
+        path = self.path(key)
+        self.discard(key)
+
+        size = entry_size(src)
+        path.parent.mkdir(exist_ok=True)
+        try:
+            os.replace(src, path)
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            # a directory stored by another process in the meantime: keys
+            # name the content, so keep that one
+            remove_entry(src)
+            size = entry_size(path)
+
+        self.entries[key] = size
+        self.size += size
+        self.evict()
+        return path
+
+    def put_bytes(self, key: str, data: bytes) -> Path:
+        fd, tmp = tempfile.mkstemp(dir=self.tmp)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        return self.put_path(key, Path(tmp))
+
+    def discard(self, key: str) -> None:
+        if key not in self.entries:
+            return
+
+        self.size -= self.entries.pop(key)
+        remove_entry(self.path(key))
+
+    def pin(self, key: str) -> None:
+        """
+        Keep an entry from being evicted, by any process. Raise
+        FileNotFoundError if the entry does not exist (anymore).
+        """
+        if key not in self.pins:
+            self.pin_fds[key] = self._lock(key)
+        self.pins[key] += 1
+
+    def unpin(self, key: str) -> None:
+        self.pins[key] -= 1
+        if self.pins[key] <= 0:
+            del self.pins[key]
+            # releases the lock
+            os.close(self.pin_fds.pop(key))
+
+    def _lock(self, key: str) -> int:
+        path = self.path(key)
+
+        while True:
+            fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+            # waits for an eviction in progress
+            fcntl.flock(fd, fcntl.LOCK_SH)
+
+            try:
+                same = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                os.close(fd)
+                raise
+
+            if same:
+                return fd
+            # evicted and stored again meanwhile
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def pinned(self, key: str):
+        self.pin(key)
+        try:
+            yield
+        finally:
+            self.unpin(key)
+
+    def evict(self) -> None:
+        for key in list(self.entries):
+            if self.size <= self.max_size:
+                return
+            if key in self.pins:
+                continue
+
+            try:
+                fd = os.open(self.path(key), os.O_RDONLY | os.O_CLOEXEC)
+            except FileNotFoundError:
+                # removed by another process
+                self.size -= self.entries.pop(key)
+                continue
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # pinned by another process
+                os.close(fd)
+                continue
+
+            try:
+                logger.debug("evicting %s from %s", key, self.root)
+                self.discard(key)
+            finally:
+                os.close(fd)
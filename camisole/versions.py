@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import camisole.languages
+from camisole.conf import conf
+from camisole.models import Program
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_path() -> Path:
+    return Path(conf['cache-dir']).expanduser() / 'versions.json'
+
+
+def programs() -> Iterable[Program]:
+    """Programs of the registered languages telling their version."""
+    seen = set()
+
+    for lang in camisole.languages.all().values():
+        for program in lang.required_binaries():
+            if program.version_opt is None or id(program) in seen:
+                continue
+            seen.add(id(program))
+            yield program
+
+
+def snapshot_key(program: Program) -> str:
+    return f'{program.cmd} {program.version_opt}'
+
+
+def binary_stamp(program: Program) -> Optional[List[int]]:
+    """Identity of the binary, changing when it is replaced or updated."""
+    try:
+        stat = os.stat(program.cmd)
+    except OSError:
+        return None
+
+    return [stat.st_ino, stat.st_mtime_ns]
+
+
+def load_snapshot(path: Path) -> Dict[str, dict]:
+    try:
+        with path.open() as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        logger.warning("ignoring unreadable version snapshot %s", path)
+        return {}
+
+    return snapshot if isinstance(snapshot, dict) else {}
+
+
+def save_snapshot(path: Path, snapshot: Dict[str, dict]) -> None:
+    # written atomically, as server workers may read it at the same time
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}')
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(snapshot, indent=2, sort_keys=True))
+        os.replace(tmp, path)
+    except OSError:
+        logger.warning("cannot write version snapshot %s", path,
+                       exc_info=True)
+
+
+async def probe_all(path: Optional[Path] = None) -> None:
+    """
+    Know the version of every program, without running those whose binary
+    did not change since the snapshot at ``path`` was taken. The others are
+    run all at the same time, and the snapshot is updated.
+    """
+    path = path or snapshot_path()
+    snapshot = load_snapshot(path)
+    stale = []
+
+    for program in programs():
+        stamp = binary_stamp(program)
+        entry = snapshot.get(snapshot_key(program))
+
+        if stamp is not None and isinstance(entry, dict) and \
+                entry.get('stamp') == stamp and \
+                isinstance(entry.get('output'), str):
+            program.version_output = entry['output']
+        else:
+            stale.append((program, stamp))
+
+    if not stale:
+        return
+
+    results = await asyncio.gather(
+        *(program.probe_version() for program, _ in stale),
+        return_exceptions=True)
+
+    for (program, stamp), result in zip(stale, results):
+        if isinstance(result, Exception):
+            logger.warning("cannot get the version of %s: %s",
+                           program.cmd, result)
+            continue
+
+        if stamp is not None:
+            snapshot[snapshot_key(program)] = {'stamp': stamp,
+                                               'output': result}
+
+    save_snapshot(path, snapshot)
@@ -0,0 +1,72 @@
+import logging
+import os
+import signal
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# delay before restarting a dead worker, so that workers failing right after
+# their startup don't make us spin
+RESTART_DELAY = 1
+
+
+def prefork(count: int, target: Callable[[int], None]) -> None:
+    """
+    Run ``target`` in ``count`` forked worker processes, given the index of
+    the worker, restarting those that die, until SIGINT or SIGTERM, which is
+    forwarded to the workers.
+    """
+    # pid -> worker index
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                target(index)
+            except BaseException:
+                logger.exception("worker %d failed", index)
+                code = 1
+            finally:
+                os._exit(code)
+
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index in range(count):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+
+        logger.error("worker %d (pid %d) exited with code %d, restarting",
+                     index, pid, os.waitstatus_to_exitcode(status))
+        time.sleep(RESTART_DELAY)
+
+        if not stopping:
+            spawn(index)
@@ -18,6 +18,9 @@ setup(
         'msgpack',
         'pyyaml',
     ],
+    extras_require={
+        'fast': ['orjson'],
+    },
     setup_requires=['pytest-runner', 'setuptools_scm'],
     tests_require=['pytest', 'pytest-cov', 'pytest-asyncio'],
     test_suite='pytest',
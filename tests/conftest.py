@@ -4,6 +4,7 @@ import pytest
 from aiohttp.test_utils import BaseTestServer, TestServer, TestClient
 from aiohttp.web import Application
 
+from camisole.conf import conf
 from camisole.httpserver import make_application
 
 # load builtins once and for all
@@ -11,6 +12,16 @@ from camisole.languages import load_builtins
 load_builtins()
 
 
+@pytest.fixture
+def set_conf(monkeypatch):
+    """Override a configuration setting for the duration of a test."""
+    def set(key, value):
+        conf.merge({})  # make sure the configuration is loaded
+        monkeypatch.setitem(conf._data, key, value)
+
+    return set
+
+
 @pytest.yield_fixture
 def aio_client(event_loop):
     """
@@ -0,0 +1,57 @@
+import pickle
+
+import pytest
+
+import camisole.artifacts
+from camisole.artifacts import clone_file
+
+
+@pytest.fixture
+def store(set_conf, tmp_path):
+    set_conf('cache-dir', str(tmp_path))
+    camisole.artifacts.artifact_store.cache_clear()
+    yield camisole.artifacts.artifact_store()
+    camisole.artifacts.artifact_store.cache_clear()
+
+
+def test_clone_file(tmp_path):
+    (tmp_path / 'src').write_bytes(b'x' * 100000)
+    clone_file(tmp_path / 'src', tmp_path / 'dst')
+    assert (tmp_path / 'dst').read_bytes() == b'x' * 100000
+
+
+def test_put_files(store, tmp_path):
+    (tmp_path / 'Foo.class').write_bytes(b'foo')
+    (tmp_path / 'Bar.class').write_bytes(b'bar')
+
+    artifact = store.put_files([('Foo.class', tmp_path / 'Foo.class'),
+                                ('Bar.class', tmp_path / 'Bar.class')])
+
+    assert artifact.exists()
+    assert [(name, path.read_bytes()) for name, path in artifact.files()] == \
+        [('Foo.class', b'foo'), ('Bar.class', b'bar')]
+    # the files are copies
+    (tmp_path / 'Foo.class').write_bytes(b'changed')
+    assert (artifact.path / 'Foo.class').read_bytes() == b'foo'
+
+
+def test_handle(store, tmp_path):
+    (tmp_path / 'compiled').write_bytes(b'binary')
+    artifact = store.put_files([('compiled', tmp_path / 'compiled')])
+
+    assert pickle.loads(pickle.dumps(artifact)) == artifact
+
+    store.discard(artifact.key)
+    assert not artifact.exists()
+
+
+def test_pinned(store, tmp_path):
+    (tmp_path / 'compiled').write_bytes(b'binary')
+    artifact = store.put_files([('compiled', tmp_path / 'compiled')])
+
+    with camisole.artifacts.pinned(artifact):
+        assert artifact.key in store.pins
+    assert artifact.key not in store.pins
+
+    with camisole.artifacts.pinned(b'interpreted source'):
+        pass
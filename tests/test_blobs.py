@@ -0,0 +1,66 @@
+import hashlib
+
+import pytest
+
+from camisole.blobs import BlobError, BlobStore, BlobTooLarge
+
+
+def test_put(tmp_path):
+    store = BlobStore(tmp_path, 100)
+    key = store.put(b'input')
+
+    assert key == hashlib.sha256(b'input').hexdigest()
+    assert store.blob_path(key).read_bytes() == b'input'
+    # the blob is alone in its directory, so that it can be mounted
+    assert list(store.path(key).iterdir()) == [store.blob_path(key)]
+
+
+def test_put_twice(tmp_path):
+    store = BlobStore(tmp_path, 100)
+    path = store.blob_path(store.put(b'input'))
+    mtime = path.stat().st_mtime_ns
+
+    assert store.blob_path(store.put(b'input')) == path
+    assert path.stat().st_mtime_ns == mtime
+    assert store.size == 5
+
+
+def test_missing(tmp_path):
+    store = BlobStore(tmp_path, 100)
+    assert store.blob_path(hashlib.sha256(b'input').hexdigest()) is None
+
+
+async def chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_put_stream(tmp_path):
+    store = BlobStore(tmp_path, 100)
+    key = hashlib.sha256(b'input').hexdigest()
+
+    assert await store.put_stream(key, chunks(b'in', b'put'))
+    assert store.blob_path(key).read_bytes() == b'input'
+    assert not await store.put_stream(key, chunks(b'in', b'put'))
+
+
+@pytest.mark.asyncio
+async def test_put_stream_bad_hash(tmp_path):
+    store = BlobStore(tmp_path, 100)
+    key = hashlib.sha256(b'input').hexdigest()
+
+    with pytest.raises(BlobError):
+        await store.put_stream(key, chunks(b'output'))
+    assert key not in store
+    assert not list(store.tmp.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_put_stream_too_large(tmp_path):
+    store = BlobStore(tmp_path, 4)
+    key = hashlib.sha256(b'input').hexdigest()
+
+    with pytest.raises(BlobTooLarge):
+        await store.put_stream(key, chunks(b'in', b'put'))
+    assert key not in store
@@ -0,0 +1,172 @@
+import asyncio
+import pytest
+from pathlib import Path
+
+import camisole.isolate
+from camisole.boxes import (BoxLocks, BoxPool, BoxQueueFull, NoBoxAvailable,
+                            WarmBoxPool)
+
+
+@pytest.mark.asyncio
+async def test_acquire_release():
+    pool = BoxPool(2)
+    a = await pool.acquire()
+    b = await pool.acquire()
+    assert {a, b} == {0, 1}
+    assert pool.busy == {0, 1}
+
+    pool.release(a)
+    assert await pool.acquire() == a
+
+
+@pytest.mark.asyncio
+async def test_exhausted():
+    pool = BoxPool(1, max_waiters=0)
+    await pool.acquire()
+    with pytest.raises(NoBoxAvailable) as e:
+        await pool.acquire()
+    assert "waiting for an isolate box" in str(e.value)
+
+
+@pytest.mark.asyncio
+async def test_release_twice_is_harmless():
+    pool = BoxPool(1)
+    box_id = await pool.acquire()
+    pool.release(box_id)
+    pool.release(box_id)
+    assert list(pool.free) == [box_id]
+
+
+@pytest.mark.asyncio
+async def test_wait_for_release():
+    pool = BoxPool(1)
+    box_id = await pool.acquire()
+
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    pool.release(box_id)
+    assert await waiter == box_id
+    assert pool.busy == {box_id}
+    assert not pool.free
+
+
+@pytest.mark.asyncio
+async def test_queue_full():
+    pool = BoxPool(1, max_waiters=1)
+    await pool.acquire()
+
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(BoxQueueFull):
+        await pool.acquire()
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert not pool.waiters
+
+
+@pytest.mark.asyncio
+async def test_wait_timeout():
+    pool = BoxPool(1, timeout=.01)
+    box_id = await pool.acquire()
+
+    with pytest.raises(NoBoxAvailable) as e:
+        await pool.acquire()
+    assert "Timed out" in str(e.value)
+    assert not pool.waiters
+
+    pool.release(box_id)
+    assert list(pool.free) == [box_id]
+
+
+@pytest.mark.asyncio
+async def test_stale_box_kept_aside():
+    pool = BoxPool(2, stale_delay=.05)
+    stale = await pool.acquire()
+    pool.mark_stale(stale)
+
+    # the stale box is not handed out again until the delay expires
+    other = await pool.acquire()
+    assert other != stale
+    pool.release(other)
+    assert await pool.acquire() == other
+
+    await asyncio.sleep(.06)
+    assert await pool.acquire() == stale
+
+
+@pytest.fixture
+def fake_isolate(monkeypatch):
+    calls = []
+
+    async def communicate(cmdline, data=None, **kwargs):
+        box_id, action = cmdline[2], cmdline[-1]
+        calls.append((int(box_id), action))
+        return 0, f'/var/lib/isolate/{box_id}\n'.encode(), b''
+
+    monkeypatch.setattr(camisole.isolate, 'communicate', communicate)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_cold_box_pool(fake_isolate):
+    pool = WarmBoxPool(BoxPool(2))
+    box_id, root = await pool.acquire()
+    assert root == Path(f'/var/lib/isolate/{box_id}')
+    assert fake_isolate == [(box_id, '--init')]
+
+    await pool.release(box_id)
+    assert fake_isolate[-1] == (box_id, '--cleanup')
+    assert not pool.pool.busy
+
+
+@pytest.mark.asyncio
+async def test_warm_box_pool(fake_isolate):
+    pool = WarmBoxPool(BoxPool(3), size=2)
+    await pool.warm_up()
+    assert len(pool.ready) == 2
+    assert sorted(fake_isolate) == [(0, '--init'), (1, '--init')]
+    fake_isolate.clear()
+
+    # a ready box is handed out without calling isolate, and another box is
+    # warmed to replace it
+    box_id, _ = await pool.acquire()
+    assert all(b != box_id for b, _ in fake_isolate)
+    await pool.join()
+    assert len(pool.ready) == 2
+
+    # released boxes are cleaned up in the background
+    await pool.release(box_id)
+    await pool.join()
+    assert (box_id, '--cleanup') in fake_isolate
+    assert len(pool.ready) == 2
+    assert len(pool.pool.busy) == 2
+
+    await pool.drain()
+    assert not pool.ready
+    assert not pool.pool.busy
+
+
+@pytest.mark.asyncio
+async def test_shared_between_processes(tmp_path):
+    # flock(2) locks of two file descriptors conflict, even in one process
+    first = BoxPool(2, locks=BoxLocks(tmp_path), poll_interval=.01)
+    second = BoxPool(2, locks=BoxLocks(tmp_path), poll_interval=.01)
+
+    a = await first.acquire()
+    b = await second.acquire()
+    assert {a, b} == {0, 1}
+
+    waiter = asyncio.ensure_future(second.acquire())
+    await asyncio.sleep(.02)
+    assert not waiter.done()
+
+    # released by the other process
+    first.release(a)
+    assert await asyncio.wait_for(waiter, 1) == a
+    assert second.busy == {0, 1}
+    assert first.try_acquire() is None
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+
+from camisole.cache import CompileCache, SingleFlight, digest
+
+
+def test_digest():
+    assert digest('a', b'b') == digest('a', b'b')
+    assert digest('a', b'b') != digest('a', 'b')
+    assert digest({'x': 1, 'y': 2}) == digest({'y': 2, 'x': 1})
+    assert digest('ab', 'c') != digest('a', 'bc')
+
+
+def test_memory_tier():
+    cache = CompileCache(1024)
+    value = (0, {'stderr': b''}, [('', b'binary')], {})
+    cache.put('k', value)
+    hit = cache.get('k')
+    assert hit == value
+    # hits are copies
+    hit[1]['stderr'] += b'foo'
+    assert cache.get('k') == value
+    assert cache.get('nope') is None
+
+
+def test_memory_tier_eviction():
+    cache = CompileCache(300)
+    cache.put('a', b'a' * 100)
+    cache.put('b', b'b' * 100)
+    cache.get('a')
+    cache.put('c', b'c' * 100)
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.memory_used <= 300
+
+
+def test_disk_tier(tmp_path):
+    key = digest('k')
+    cache = CompileCache(1024, disk_root=tmp_path, disk_size=1024)
+    cache.put(key, b'value')
+
+    cache = CompileCache(1024, disk_root=tmp_path, disk_size=1024)
+    assert cache.get(key) == b'value'
+    assert key in cache.memory
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    flight = SingleFlight()
+    calls = []
+
+    async def func():
+        calls.append(None)
+        await asyncio.sleep(.01)
+        return {'result': []}
+
+    results = await asyncio.gather(*[flight.do('k', func) for _ in range(5)])
+    assert len(calls) == 1
+    assert all(r == {'result': []} for r in results)
+    # everyone gets their own copy
+    results[0]['result'].append(1)
+    assert results[1] == {'result': []}
+    assert not flight.inflight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_error():
+    flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(.01)
+        raise ValueError("nope")
+
+    results = await asyncio.gather(*[flight.do('k', func) for _ in range(3)],
+                                   return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert not flight.inflight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_leader_cancelled():
+    flight = SingleFlight()
+    calls = []
+
+    async def func():
+        calls.append(None)
+        await asyncio.sleep(.01)
+        return 42
+
+    leader = asyncio.ensure_future(flight.do('k', func))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flight.do('k', func))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await follower == 42
+    assert len(calls) == 2
@@ -2,16 +2,72 @@ import os
 import json
 import pytest
 
-from camisole.httpserver import TYPE_JSON, CONTENT_TYPES, BinaryJsonEncoder
+from camisole.httpserver import (TYPE_JSON, TYPE_MSGPACK, CONTENT_TYPES,
+                                  BinaryPayload, batch_submissions, encode,
+                                  json_msgpack_handler, to_json_compatible)
 
 
-def test_best_effort_json_binary_encoder():
-    assert json.dumps({"key": "test".encode()}, cls=BinaryJsonEncoder)
-    assert json.dumps({"key": "dédé".encode()}, cls=BinaryJsonEncoder)
-    with pytest.raises(TypeError):
-        assert json.dumps({"key": b"test\xa0"}, cls=BinaryJsonEncoder)
-    with pytest.raises(TypeError):
-        assert json.dumps({"key": object()}, cls=BinaryJsonEncoder)
+def test_to_json_compatible():
+    payload = {'a': [b'foo', ('d\xe9'.encode(), 42)], 'b': None}
+    assert to_json_compatible(payload) == \
+        {'a': ['foo', ['d\xe9', 42]], 'b': None}
+
+    with pytest.raises(BinaryPayload):
+        to_json_compatible({'a': b'\xff'})
+    with pytest.raises(BinaryPayload):
+        to_json_compatible({'key': b'test\xa0'})
+    assert to_json_compatible({'a': b'\xff'}, base64_bytes=True) == \
+        {'a': {'base64': '/w=='}}
+
+
+@pytest.mark.asyncio
+async def test_encoder_errors_are_not_406():
+    from aiohttp.test_utils import make_mocked_request
+
+    def request(accept):
+        return make_mocked_request('GET', '/', headers={'accept': accept})
+
+    @json_msgpack_handler
+    async def too_large(request, data):
+        return {'value': 2 ** 70}
+
+    @json_msgpack_handler
+    async def binary(request, data):
+        return {'value': b'\xff'}
+
+    response = await too_large(request(TYPE_MSGPACK))
+    assert response.status == 500
+    assert b'Traceback' in response.body
+    assert (await binary(request(TYPE_JSON))).status == 406
+
+
+def test_batch_submissions_do_not_share_options():
+    data = {'lang': 'java', 'execute': {'virt-mem': 1000},
+            'submissions': [{'source': 'a'}, {'source': 'b'},
+                            {'source': 'c', 'lang': 'c'}]}
+    submissions = batch_submissions(data)
+    assert [(s['lang'], s['source']) for s in submissions] == \
+        [('java', 'a'), ('java', 'b'), ('c', 'c')]
+
+    submissions[0]['execute'].pop('virt-mem')
+    assert submissions[1]['execute'] == {'virt-mem': 1000}
+    assert data['execute'] == {'virt-mem': 1000}
+
+
+def test_encode_picks_first_able_type():
+    content_type, data = encode({'a': b'foo'}, CONTENT_TYPES)
+    assert content_type == TYPE_JSON
+    assert json.loads(data) == {'a': 'foo'}
+
+    content_type, data = encode({'a': b'\xff'}, CONTENT_TYPES)
+    assert content_type == TYPE_MSGPACK
+
+    with pytest.raises(BinaryPayload):
+        encode({'a': b'\xff'}, [TYPE_JSON])
+
+    content_type, data = encode({'a': b'\xff'}, [TYPE_JSON],
+                                base64_bytes=True)
+    assert json.loads(data) == {'a': {'base64': '/w=='}}
 
 
 @pytest.mark.asyncio
@@ -159,3 +215,148 @@ async def test_languages(json_request, accept):
     assert 'programs' in result['languages']['c']
     programs = result['languages']['c']['programs']
     assert '-Wall' in programs['gcc']['opts']
+
+
+@pytest.mark.asyncio
+async def test_languages_etag(http_client):
+    resp = await http_client.get('/languages')
+    assert resp.status == 200
+    etag = resp.headers['ETag']
+
+    resp = await http_client.get('/languages',
+                                 headers={'If-None-Match': etag})
+    assert resp.status == 304
+    assert resp.headers['ETag'] == etag
+
+    resp = await http_client.get('/languages',
+                                 headers={'If-None-Match': '"other"'})
+    assert resp.status == 200
+
+
+@pytest.mark.asyncio
+async def test_run_no_box_available(http_client, monkeypatch):
+    from camisole.boxes import BoxPool, WarmBoxPool
+    from camisole.isolate import Isolator
+
+    pool = BoxPool(0, max_waiters=0)
+    monkeypatch.setattr(Isolator, 'box_pool', pool)
+    monkeypatch.setattr(Isolator, 'warm_pool', WarmBoxPool(pool))
+    result = await http_client.post(
+        '/run', json={'lang': 'python', 'source': 'print(42)'})
+    assert result.status == 503
+    assert 'Retry-After' in result.headers
+    data = await result.json()
+    assert not data['success']
+    assert 'waiting for an isolate box' in data['error']
+
+
+@pytest.fixture
+def blob_store(set_conf, tmp_path):
+    import camisole.blobs
+
+    set_conf('cache-dir', str(tmp_path))
+    camisole.blobs.blob_store.cache_clear()
+    yield camisole.blobs.blob_store()
+    camisole.blobs.blob_store.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_blobs(http_client, blob_store):
+    import hashlib
+
+    key = hashlib.sha256(b'42\n').hexdigest()
+    assert (await http_client.head(f'/blobs/{key}')).status == 404
+
+    result = await http_client.put(f'/blobs/{key}', data=b'42\n')
+    assert result.status == 201
+    assert (await http_client.head(f'/blobs/{key}')).status == 200
+    result = await http_client.put(f'/blobs/{key}', data=b'42\n')
+    assert result.status == 200
+
+    result = await http_client.put(f'/blobs/{"0" * 64}', data=b'42\n')
+    assert result.status == 400
+
+    result = await http_client.post('/run', json={
+        'lang': 'python', 'source': 'print(input())',
+        'tests': [{'stdin_ref': key}]})
+    data = await result.json()
+    assert data['tests'][0]['stdout'] == '42\n'
+
+
+@pytest.mark.asyncio
+async def test_run_unknown_blob(json_request, blob_store):
+    result = await json_request('/run', {
+        'lang': 'python', 'source': 'print(input())',
+        'tests': [{'stdin_ref': '0' * 64}]})
+    assert not result['success']
+    assert 'unknown blob' in result['error']
+
+
+@pytest.mark.asyncio
+async def test_run_batch(http_client):
+    result = await http_client.post('/run/batch', json={
+        'lang': 'python', 'tests': [{'stdin': '42'}],
+        'submissions': [{'source': 'print(input())'}, {'source': 42}]})
+    assert result.headers['content-type'] == 'application/x-ndjson'
+
+    lines = (await result.read()).splitlines()
+    results = sorted((json.loads(line) for line in lines),
+                     key=lambda r: r['index'])
+    assert [r['index'] for r in results] == [0, 1]
+    assert results[0]['success']
+    assert results[0]['tests'][0]['stdout'] == '42\n'
+    assert not results[1]['success']
+    assert 'malformed payload' in results[1]['error']
+
+
+@pytest.mark.asyncio
+async def test_run_batch_bad_schema(json_request):
+    result = await json_request('/run/batch', {'lang': 'python'})
+    assert not result['success']
+    assert ".submissions: expected a list" in result['error']
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('accept,query', [
+    ('application/x-ndjson', ''),
+    (TYPE_JSON, '?stream=1'),
+])
+async def test_run_stream(http_client, accept, query):
+    result = await http_client.post(f'/run{query}', json={
+        'lang': 'c', 'source': 'int main() { return 0; }',
+        'tests': [{'name': 'a'}, {'name': 'b'}]}, headers={'accept': accept})
+    assert result.headers['content-type'] == 'application/x-ndjson'
+
+    events = [json.loads(line) for line in (await result.read()).splitlines()]
+    assert [e['event'] for e in events] == ['compile', 'test', 'test', 'done']
+    assert sorted(e['test']['name'] for e in events[1:3]) == ['a', 'b']
+    assert events[-1] == {'event': 'done', 'success': True}
+
+
+@pytest.mark.asyncio
+async def test_run_stream_sse(http_client):
+    result = await http_client.post('/run', json={
+        'lang': 'python', 'source': 'print(42)'},
+        headers={'accept': 'text/event-stream'})
+    assert result.headers['content-type'] == 'text/event-stream'
+
+    events = (await result.read()).decode().split('\n\n')
+    assert events[0].startswith('event: test\ndata: {')
+    name, data = events[1].split('\n')
+    assert name == 'event: done'
+    assert json.loads(data[len('data: '):]) == {'event': 'done', 'success': True}
+
+
+@pytest.mark.asyncio
+async def test_jobs(json_request):
+    job = await json_request('/jobs', {'lang': 'python', 'source': 'print(42)'})
+    assert job['success']
+    assert job['status'] in ('queued', 'running')
+
+    job = await json_request(f'/jobs/{job["id"]}?wait=30')
+    assert job['status'] == 'done'
+    assert job['result']['tests'][0]['stdout'] == '42\n'
+
+    result = await json_request('/jobs/nope')
+    assert not result['success']
+    assert 'unknown job' in result['error']
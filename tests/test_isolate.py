@@ -33,4 +33,32 @@ async def test_invalid_binary():
     assert b'execve' in isolator.isolate_stderr
 
 
+@pytest.mark.asyncio
+async def test_output_limit():
+    isolator = camisole.isolate.Isolator({'output-limit': 4})
+    async with isolator:
+        await isolator.run(['/bin/bash', '-c', 'echo 12345678; echo err >&2'])
+    assert isolator.info['stdout'] == b'1234'
+    assert isolator.info['stderr'] == b'err\n'
+    assert isolator.info['meta']['stdout-truncated']
+    assert not isolator.info['meta']['stderr-truncated']
+
+
+@pytest.mark.asyncio
+async def test_negative_output_limit():
+    isolator = camisole.isolate.Isolator({'output-limit': -1})
+    async with isolator:
+        await isolator.run(['/bin/bash', '-c', 'echo 12345678'])
+    assert isolator.info['stdout'] == b''
+    assert isolator.info['meta']['stdout-truncated']
+
+
+def test_read_limited(tmp_path):
+    path = tmp_path / 'out'
+    path.write_bytes(b'12345678')
+    assert camisole.isolate.read_limited(path, 4) == (b'1234', True)
+    assert camisole.isolate.read_limited(path, 8) == (b'12345678', False)
+    assert camisole.isolate.read_limited(path, None) == (b'12345678', False)
+
+
 # TODO: test a lot of error cases!
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+
+from camisole.jobs import JobQueueFull, JobStore
+
+
+async def result(value, delay=0):
+    await asyncio.sleep(delay)
+    return {'value': value}
+
+
+@pytest.mark.asyncio
+async def test_job():
+    store = JobStore(1024, 60, parallelism=1)
+    job = store.submit(lambda: result(42, .1))
+    assert job.to_dict() == {'id': job.id, 'status': 'queued'}
+
+    await job.wait(.01)
+    assert job.status == 'running'
+    await job.wait(1)
+    assert job.to_dict() == {'id': job.id, 'status': 'done',
+                             'result': {'value': 42}}
+    assert store.get(job.id) is job
+    assert store.get('nope') is None
+
+
+@pytest.mark.asyncio
+async def test_parallelism():
+    store = JobStore(1024, 60, parallelism=1)
+    first = store.submit(lambda: result(1, .1))
+    second = store.submit(lambda: result(2))
+    await asyncio.sleep(.01)
+    assert (first.status, second.status) == ('running', 'queued')
+    await second.wait(1)
+    assert first.status == 'done'
+
+
+@pytest.mark.asyncio
+async def test_max_pending():
+    store = JobStore(1024, 60, parallelism=1, max_pending=1)
+    job = store.submit(lambda: result(1))
+    with pytest.raises(JobQueueFull):
+        store.submit(lambda: result(2))
+
+    await job.wait(1)
+    store.submit(lambda: result(2))
+
+
+@pytest.mark.asyncio
+async def test_discard_cancels():
+    store = JobStore(1024, 60, parallelism=1)
+    job = store.submit(lambda: result(1, 10))
+    await asyncio.sleep(.01)
+    assert store.discard(job.id) is job
+    await asyncio.sleep(.01)
+    assert job.task.cancelled()
+    assert store.get(job.id) is None
+    assert store.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_eviction_ttl():
+    store = JobStore(1024, 0, parallelism=1)
+    job = store.submit(lambda: result(1))
+    await job.wait(1)
+    assert store.get(job.id) is None
+    # still there for those who waited for it
+    assert job.result == {'value': 1}
+
+
+@pytest.mark.asyncio
+async def test_eviction_size():
+    store = JobStore(300, 60, parallelism=2)
+    first = store.submit(lambda: result('a' * 100))
+    second = store.submit(lambda: result('b' * 100))
+    await second.wait(1)
+    await first.wait(1)
+    third = store.submit(lambda: result('c' * 100))
+    await third.wait(1)
+
+    assert store.size <= 300
+    assert store.get(first.id) is None
+    assert store.get(third.id) is third
+
+
+@pytest.mark.asyncio
+async def test_spool(tmp_path):
+    # stores of two processes
+    first = JobStore(1024, 60, parallelism=1, spool=tmp_path)
+    second = JobStore(1024, 60, parallelism=1, spool=tmp_path)
+    job = first.submit(lambda: result(42, .1))
+
+    other = second.get(job.id)
+    assert other.status == 'running'
+    await other.wait(1)
+    assert other.to_dict() == {'id': job.id, 'status': 'done',
+                               'result': {'value': 42}}
+
+    second.discard(job.id)
+    assert second.get(job.id) is None
+    assert second.get('../' + job.id) is None
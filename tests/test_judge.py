@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+import camisole.judge
+from camisole.judge import judge, tokens
+
+
+@pytest.fixture
+def compare(tmp_path):
+    def compare(output, expected, *args):
+        (tmp_path / 'output').write_bytes(output)
+        (tmp_path / 'expected').write_bytes(expected)
+        return judge(tmp_path / 'output', tmp_path / 'expected', *args)
+
+    return compare
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # make tokens and differences span several chunks
+    monkeypatch.setattr(camisole.judge, 'CHUNK_SIZE', 3)
+
+
+def test_tokens(small_chunks):
+    assert list(tokens(io.BytesIO(b'ab cdef\n\n g  h'))) == \
+        [(b'ab', 0), (b'cdef', 3), (b'g', 10), (b'h', 13)]
+
+
+def test_tokens_too_long(monkeypatch, small_chunks):
+    monkeypatch.setattr(camisole.judge, 'MAX_TOKEN_SIZE', 4)
+    assert list(tokens(io.BytesIO(b'ab cdefgh ij'))) == \
+        [(b'ab', 0), (None, 3)]
+
+
+def test_exact(compare, small_chunks):
+    assert compare(b'1 2 3\n', b'1 2 3\n')['verdict'] == 'OK'
+
+    result = compare(b'1 2 4\n', b'1 2 3\n')
+    assert result['verdict'] == 'WRONG_ANSWER'
+    assert result['diff']['output'] == {'offset': 4, 'excerpt': '1 2 4\n'}
+    assert result['diff']['expected'] == {'offset': 4, 'excerpt': '1 2 3\n'}
+
+    result = compare(b'1 2 3', b'1 2 3\n')
+    assert result['verdict'] == 'WRONG_ANSWER'
+    assert result['diff']['output']['offset'] == 5
+
+
+def test_whitespace(compare, small_chunks):
+    assert compare(b' hello \n world\n\n', b'hello world',
+                   'whitespace')['verdict'] == 'OK'
+
+    result = compare(b'hello worlds', b'hello world', 'whitespace')
+    assert result['verdict'] == 'WRONG_ANSWER'
+    assert result['diff']['output']['offset'] == 6
+
+    result = compare(b'hello', b'hello world', 'whitespace')
+    assert result['verdict'] == 'WRONG_ANSWER'
+    assert result['diff']['output']['offset'] == 5
+    assert result['diff']['expected']['offset'] == 6
+
+
+def test_float(compare):
+    assert compare(b'0.3333333 1e9 nan x', b'0.333333333 1000000000.5 nan x',
+                   'float')['verdict'] == 'OK'
+    assert compare(b'0.34', b'0.333', 'float')['verdict'] == 'WRONG_ANSWER'
+    assert compare(b'0.34', b'0.333', 'float', .01)['verdict'] == 'OK'
+    assert compare(b'x', b'y', 'float')['verdict'] == 'WRONG_ANSWER'
+
+
+def test_excerpt_cuts_characters(compare, monkeypatch):
+    monkeypatch.setattr(camisole.judge, 'EXCERPT_SIZE', 3)
+    result = compare('éé'.encode(), 'éè'.encode())
+    assert result['verdict'] == 'WRONG_ANSWER'
+    assert isinstance(result['diff']['output']['excerpt'], str)
+
+
+def test_unknown_mode(compare):
+    with pytest.raises(ValueError):
+        compare(b'', b'', 'fuzzy')
@@ -107,3 +107,116 @@ async def test_bad_compile_ref():
 def test_compile_command_with_no_compiler():
     assert (Python({'source': 'print(42)'})
             .compile_command('print(42)', 'test.bin')) is None
+
+
+@pytest.mark.asyncio
+async def test_single_box():
+    # files left by a test must not be seen by the next one
+    source = ('import os; print(os.path.exists("foo")); '
+              'open("foo", "w").write("bar")')
+    result = await Python.executer({'lang': 'python', 'source': source,
+                                    'single_box': True,
+                                    'tests': [{}, {}]}).run()
+    assert [t['stdout'] for t in result['tests']] == [b'False\n'] * 2
+
+
+@pytest.mark.asyncio
+async def test_single_box_compiled():
+    from camisole.languages.c import C
+
+    result = await C.executer({'lang': 'c', 'source': C.reference_source,
+                               'single_box': True, 'tests': [{}, {}]}).run()
+    assert result['compile']['exitcode'] == 0
+    assert [t['stdout'] for t in result['tests']] == [b'42\n'] * 2
+
+
+@pytest.mark.asyncio
+async def test_parallel_tests_keep_order(set_conf):
+    set_conf('test-parallelism', 4)
+
+    source = 'import sys, time; s = input(); time.sleep(.1 * int(s)); print(s)'
+    result = await Python.executer({
+        'lang': 'python', 'source': source, 'parallelism': 4,
+        'tests': [{'stdin': str(i)} for i in (3, 0, 2, 1)],
+    }).run()
+    assert [t['stdout'] for t in result['tests']] == \
+        [b'3\n', b'0\n', b'2\n', b'1\n']
+
+
+@pytest.mark.asyncio
+async def test_parallel_fatal_test_errors_out(set_conf):
+    set_conf('test-parallelism', 4)
+
+    result = await Python.executer({
+        'lang': 'python', 'source': '1 / 0', 'parallelism': 4, 'tests': [
+            {'fatal': False},
+            {'fatal': True},
+            {'fatal': False},
+            {'fatal': False},
+        ]}).run()
+    assert result['tests'][0]['meta']['status'] == 'RUNTIME_ERROR'
+    assert result['tests'][1]['meta']['status'] == 'RUNTIME_ERROR'
+    assert result['tests'][2] == {}
+    assert result['tests'][3] == {}
+
+
+@pytest.mark.asyncio
+async def test_checker():
+    # accepts any output having the same number of lines as the expected one
+    checker = ('import sys; _, i, o, e = sys.argv; '
+               'sys.exit(len(open(o).readlines()) != '
+               'len(open(e).readlines()))')
+    result = await Python.executer({
+        'lang': 'python', 'source': 'print(input())',
+        'checker': {'lang': 'python', 'source': checker},
+        'tests': [{'stdin': 'a', 'expected': 'b\n'},
+                  {'stdin': 'a', 'expected': 'b\nc\n'}],
+    }).run()
+    assert [t['judge']['verdict'] for t in result['tests']] == \
+        ['OK', 'WRONG_ANSWER']
+    assert 'stdout' not in result['tests'][0]
+
+
+@pytest.mark.asyncio
+async def test_unknown_ref_releases_pins(tmp_path, monkeypatch):
+    import camisole.blobs
+    store = camisole.blobs.BlobStore(tmp_path, 1 << 20)
+    monkeypatch.setattr(camisole.blobs, 'blob_store', lambda: store)
+
+    lang = Python.executer({'lang': 'python', 'source': 'print(42)'})
+    with pytest.raises(RuntimeError):
+        await lang.execute(b'print(42)',
+                           {'stdin': 'hello', 'expected_ref': '0' * 64})
+    assert not store.pins
+
+
+@pytest.mark.asyncio
+async def test_judge_zero_tolerance():
+    result = await Python.executer({
+        'lang': 'python', 'source': 'print(1.0)', 'tests': [
+            {'expected': '1.0000001\n', 'judge_mode': 'float'},
+            {'expected': '1.0000001\n', 'judge_mode': 'float',
+             'judge_tolerance': 0},
+        ]}).run()
+    assert [t['judge']['verdict'] for t in result['tests']] == \
+        ['OK', 'WRONG_ANSWER']
+
+
+@pytest.mark.asyncio
+async def test_parallel_fatal_test_events(set_conf):
+    set_conf('test-parallelism', 2)
+
+    # the first test fails once the second one is done
+    source = ('import sys, time; s = input(); time.sleep(.3 - .3 * int(s)); '
+              'sys.exit(s == "0")')
+    lang = Python.executer({
+        'lang': 'python', 'source': source, 'parallelism': 2, 'tests': [
+            {'stdin': '0', 'fatal': True},
+            {'stdin': '1'},
+        ]})
+    events = []
+    lang.report = lambda event, payload: events.append((event, payload))
+    result = await lang.run()
+
+    assert result['tests'][1] == {}
+    assert [p['index'] for e, p in events if e == 'test'] == [0]
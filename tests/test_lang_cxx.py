@@ -0,0 +1,28 @@
+import pytest
+
+import camisole.languages
+from camisole.languages.cxx import CXXExecution
+
+pytestmark = pytest.mark.skipif('c++' not in camisole.languages.all(),
+                                reason="g++ is not installed")
+
+
+@pytest.mark.asyncio
+async def test_precompiled_headers(set_conf, tmp_path):
+    set_conf('cache-dir', str(tmp_path))
+    stale = tmp_path / 'pch' / 'c++' / 'stale'
+    stale.mkdir(parents=True)
+
+    cxx = CXXExecution({'lang': 'c++'})
+    assert '-I' not in cxx.compile_command('source.cc', 'compiled')
+
+    await CXXExecution.setup()
+
+    path = CXXExecution.pch_dir()
+    assert (path / 'bits' / 'stdc++.h.gch').is_file()
+    assert (path / 'bits' / 'stdc++.h').read_text() == \
+        '#include_next <bits/stdc++.h>\n'
+    assert not stale.exists()
+
+    assert f'/pch={path}' in cxx.compile_allowed_dirs()
+    assert cxx.compile_command('source.cc', 'compiled')[1:3] == ['-I', '/pch']
@@ -0,0 +1,23 @@
+import pytest
+
+import camisole.languages
+from camisole.languages.go import GoExecution
+
+pytestmark = pytest.mark.skipif('go' not in camisole.languages.all(),
+                                reason="go is not installed")
+
+
+def test_build_cache(set_conf, tmp_path):
+    set_conf('cache-dir', str(tmp_path))
+    go = GoExecution({'lang': 'go'})
+
+    assert go.compile_env()['GOCACHE'] == '/box/.gocache'
+    assert not any(d.startswith('/gocache=')
+                   for d in go.compile_allowed_dirs())
+
+    (tmp_path / 'go').mkdir()
+
+    assert go.compile_env()['GOCACHE'] == '/gocache'
+    assert f'/gocache={tmp_path / "go"}' in go.compile_allowed_dirs()
+    # the cache is of no use to the compiled programs
+    assert f'/gocache={tmp_path / "go"}' not in go.get_allowed_dirs()
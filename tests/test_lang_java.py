@@ -1,6 +1,8 @@
+import struct
+
 import pytest
 
-from camisole.languages.java import Java
+from camisole.languages.java import Java, find_public_class, has_main
 
 
 async def run_java(source):
@@ -71,3 +73,76 @@ class OtherPrivate {
     }
 }''')
     assert result['tests'][0]['stdout'] == b'public\n'
+
+
+def make_class(methods, constants=()):
+    """Build a minimal class file declaring the given (flags, name, desc)."""
+    pool = []
+
+    def utf8(s):
+        data = s.encode()
+        pool.append(b'\x01' + struct.pack('>H', len(data)) + data)
+        return len(pool)
+
+    # unused constants, to exercise the constant pool parsing
+    for tag, payload in constants:
+        pool.append(bytes([tag]) + payload)
+        if tag in (5, 6):
+            pool.append(None)
+
+    entries = []
+    for flags, name, desc in methods:
+        code = utf8('Code')
+        entries.append(
+            struct.pack('>HHHH', flags, utf8(name), utf8(desc), 1)
+            + struct.pack('>HI', code, 3) + b'\xb1\x00\x00')
+
+    pool_data = b''.join(p for p in pool if p is not None)
+    return (struct.pack('>IHHH', 0xCAFEBABE, 0, 52, len(pool) + 1)
+            + pool_data
+            + struct.pack('>HHHH', 0x21, 0, 0, 0)  # flags, this, super, itf
+            + struct.pack('>H', 0)  # fields
+            + struct.pack('>H', len(entries)) + b''.join(entries)
+            + struct.pack('>H', 0))  # attributes
+
+
+PSVMAIN = ('main', '([Ljava/lang/String;)V')
+
+
+def test_has_main():
+    assert has_main(make_class([(0x0009, *PSVMAIN)]))
+    assert has_main(make_class([(0x0001, 'foo', '()V'), (0x0019, *PSVMAIN)],
+                               constants=[(5, bytes(8)), (3, bytes(4)),
+                                          (15, bytes(3)), (6, bytes(8))]))
+
+
+def test_has_no_main():
+    assert not has_main(make_class([]))
+    assert not has_main(make_class([(0x0001, *PSVMAIN)]))
+    assert not has_main(make_class([(0x0008, *PSVMAIN)]))
+    assert not has_main(make_class([(0x0009, 'main', '()V')]))
+    assert not has_main(make_class([(0x0009, 'notmain', PSVMAIN[1])]))
+    assert not has_main(b'not a class file')
+    assert not has_main(make_class([(0x0009, *PSVMAIN)])[:-4])
+
+
+def test_find_public_class():
+    assert find_public_class('public class Main {}') == 'Main'
+    assert find_public_class('''
+import java.util.*;
+// public class Commented {}
+/* public class Commented {} */
+class Foo { public class Nested {} }
+@SuppressWarnings("unchecked")
+public final class Noël<T> extends Foo {
+    String s = "}", t = """
+        }""";
+    char c = '{';
+}''') == 'Noël'
+    assert find_public_class('public\nrecord Point(int x, int y) {}') == 'Point'
+
+
+def test_find_no_public_class():
+    assert find_public_class('class Foo { public class Bar {} }') is None
+    assert find_public_class('// public class Foo {}') is None
+    assert find_public_class('String s = "public class Foo";') is None
@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+
+import camisole.ref
+
+
+class Runs(list):
+    """Languages tested, and how many at most at the same time."""
+    running = 0
+    max_running = 0
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    runs = Runs()
+
+    async def test(lang_name, **kw):
+        runs.append(lang_name)
+        runs.running += 1
+        runs.max_running = max(runs.max_running, runs.running)
+        await asyncio.sleep(.05)
+        runs.running -= 1
+        return True, {'lang': lang_name}
+
+    monkeypatch.setattr(camisole.ref, 'test', test)
+    return runs
+
+
+@pytest.mark.asyncio
+async def test_cached(runs):
+    results = camisole.ref.TestResults(60, parallelism=1)
+    assert await results.get('c') == (True, {'lang': 'c'})
+    assert await results.get('c') == (True, {'lang': 'c'})
+    assert runs == ['c']
+
+    await results.get('c', refresh=True)
+    assert runs == ['c', 'c']
+
+
+@pytest.mark.asyncio
+async def test_ttl(runs):
+    results = camisole.ref.TestResults(0, parallelism=1)
+    await results.get('c')
+    await results.get('c')
+    assert runs == ['c', 'c']
+
+
+@pytest.mark.asyncio
+async def test_shared_run(runs):
+    results = camisole.ref.TestResults(60, parallelism=1)
+    await asyncio.gather(results.get('c'), results.get('c', refresh=True))
+    assert runs == ['c']
+
+
+@pytest.mark.asyncio
+async def test_parallelism(runs):
+    results = camisole.ref.TestResults(60, parallelism=2)
+    await asyncio.gather(*(results.get(lang) for lang in 'abcde'))
+    assert sorted(runs) == list('abcde')
+    assert runs.max_running == 2
@@ -129,3 +129,46 @@ def test_missing_field():
     with pytest.raises(camisole.schema.ValidationError) as e:
         camisole.schema.validate_run(json)
     assert "expected a string, got nothing" in str(e)
+
+
+def test_compiled_schema_error_path():
+    from camisole.schema import O, Union, compile_schema
+    validate = compile_schema({'a': [{'b': O(Union(int, str))}]})
+    validate({'a': [{'b': 1}, {'b': 'x'}, {}]})
+
+    with pytest.raises(camisole.schema.ValidationError) as e:
+        validate({'a': [{'b': 1}, {'b': 1.5}]})
+    assert e.value.path == '.a[1].b'
+    assert str(e.value) == \
+        ".a[1].b: expected an integer or a string, got a float"
+
+
+def test_negative_output_limit():
+    json = {
+        'lang': 'python',
+        'source': 'print(42)',
+        'execute': {'output-limit': -1},
+    }
+    with pytest.raises(camisole.schema.ValidationError) as e:
+        camisole.schema.validate_run(json)
+    assert str(e.value) == \
+        ".execute.output-limit: expected a non-negative integer, got -1"
+
+    json['execute']['output-limit'] = 0
+    camisole.schema.validate_run(json)
+
+
+@pytest.mark.parametrize('name', ['stdin_ref', 'expected_ref'])
+def test_bad_ref(name):
+    json = {
+        'lang': 'python',
+        'source': 'print(42)',
+        'tests': [{name: '../tmp/victim'}],
+    }
+    with pytest.raises(camisole.schema.ValidationError) as e:
+        camisole.schema.validate_run(json)
+    assert str(e.value) == (f".tests[0].{name}: expected a SHA-256 "
+                            "hexadecimal digest, got '../tmp/victim'")
+
+    json['tests'][0][name] = '0' * 64
+    camisole.schema.validate_run(json)
@@ -0,0 +1,136 @@
+import os
+import pytest
+
+from camisole.store import DiskStore
+
+
+def write_dir(store, data):
+    src = store.mkdtemp()
+    (src / 'data').write_bytes(data)
+    return src
+
+
+def test_put_get(tmp_path):
+    store = DiskStore(tmp_path, 100)
+    path = store.put_bytes('abcd', b'foo')
+    assert path.read_bytes() == b'foo'
+    assert store.get('abcd') == path
+    assert 'abcd' in store
+    assert 'ef01' not in store
+
+
+def test_invalid_key(tmp_path):
+    store = DiskStore(tmp_path / 'store', 100)
+    (tmp_path / 'victim').mkdir()
+
+    for key in ('../victim', '../../victim', 'ABCD', ''):
+        with pytest.raises(ValueError):
+            store.get(key)
+        with pytest.raises(ValueError):
+            store.put_bytes(key, b'foo')
+    assert (tmp_path / 'victim').exists()
+
+
+def test_eviction(tmp_path):
+    store = DiskStore(tmp_path, 10)
+    store.put_bytes('aa', b'1234')
+    store.put_bytes('bb', b'1234')
+    # touch aa so that bb is the least recently used
+    store.get('aa')
+    store.put_bytes('cc', b'1234')
+    assert 'aa' in store
+    assert 'bb' not in store
+    assert 'cc' in store
+    assert store.size == 8
+
+
+def test_pinned_not_evicted(tmp_path):
+    store = DiskStore(tmp_path, 4)
+    store.put_bytes('aa', b'1234')
+    store.pin('aa')
+    store.put_bytes('bb', b'1234')
+    assert 'aa' in store
+    assert 'bb' not in store
+    store.unpin('aa')
+    assert not store.pins
+
+    with store.pinned('aa'):
+        assert store.pins['aa'] == 1
+    assert not store.pins
+
+    # evicted
+    with pytest.raises(FileNotFoundError):
+        store.pin('bb')
+    assert not store.pins
+
+
+def test_pinned_by_another_process(tmp_path):
+    first = DiskStore(tmp_path, 4)
+    second = DiskStore(tmp_path, 4)
+    path = first.put_path('aa', write_dir(first, b'1234'))
+    second.get('aa')
+
+    with first.pinned('aa'):
+        second.put_path('bb', write_dir(second, b'1234'))
+        assert path.exists()
+        assert 'aa' in second.entries
+
+    # evicted once unpinned
+    second.put_path('cc', write_dir(second, b'1234'))
+    assert not path.exists()
+
+
+def test_put_race(tmp_path):
+    first = DiskStore(tmp_path, 100)
+    second = DiskStore(tmp_path, 100)
+    # neither has the entry yet
+    first_src = write_dir(first, b'1234')
+    second_src = write_dir(second, b'1234')
+    first.put_path('aa', first_src)
+    path = second.put_path('aa', second_src)
+
+    assert (path / 'data').read_bytes() == b'1234'
+    assert not second_src.exists()
+    assert second.size == 4
+
+
+def test_directory_entry(tmp_path):
+    store = DiskStore(tmp_path / 'store', 100)
+    src = store.mkdtemp()
+    (src / 'a').write_bytes(b'12')
+    (src / 'b').write_bytes(b'345')
+    path = store.put_path('dd', src)
+    assert sorted(os.listdir(path)) == ['a', 'b']
+    assert store.size == 5
+
+
+def test_scan_existing(tmp_path):
+    store = DiskStore(tmp_path, 100)
+    store.put_bytes('aa', b'1234')
+    store = DiskStore(tmp_path, 100)
+    assert store.get('aa').read_bytes() == b'1234'
+    assert store.size == 4
+
+
+def test_shared_between_processes(tmp_path):
+    first = DiskStore(tmp_path, 100)
+    second = DiskStore(tmp_path, 100)
+    first.put_bytes('aa', b'1234')
+    assert second.get('aa').read_bytes() == b'1234'
+    assert second.size == 4
+
+    first.discard('aa')
+    assert second.get('aa') is None
+    assert second.size == 0
+
+
+def test_tmp_of_dead_processes_removed(tmp_path):
+    store = DiskStore(tmp_path, 100)
+    (store.tmp / 'partial').write_bytes(b'1234')
+    # no process has such a PID
+    dead = store.tmp_root / str(2 ** 22 + 1)
+    dead.mkdir()
+
+    store = DiskStore(tmp_path, 100)
+    assert not (store.tmp / 'partial').exists()
+    assert not dead.exists()
@@ -0,0 +1,62 @@
+import os
+import pytest
+
+import camisole.versions
+from camisole.models import Program
+
+
+@pytest.fixture
+def program(tmp_path, monkeypatch):
+    # counts its runs in a file next to it
+    script = tmp_path / 'prog'
+    script.write_text('#!/bin/sh\necho run >> "$0.runs"\necho "prog 1.2.3"\n')
+    script.chmod(0o755)
+    program = Program(str(script))
+    monkeypatch.setattr(camisole.versions, 'programs', lambda: [program])
+    return program
+
+
+def runs(program):
+    try:
+        with open(program.cmd + '.runs') as f:
+            return len(f.readlines())
+    except FileNotFoundError:
+        return 0
+
+
+@pytest.mark.asyncio
+async def test_probe(program, tmp_path):
+    await camisole.versions.probe_all(tmp_path / 'versions.json')
+    assert runs(program) == 1
+    assert program.version() == '1.2.3'
+    # not run again
+    assert program.version() == '1.2.3'
+    assert runs(program) == 1
+
+
+@pytest.mark.asyncio
+async def test_snapshot(program, tmp_path):
+    path = tmp_path / 'versions.json'
+    await camisole.versions.probe_all(path)
+
+    # a new process, knowing the version from the snapshot
+    program.version_output = None
+    await camisole.versions.probe_all(path)
+    assert runs(program) == 1
+    assert program.version() == '1.2.3'
+
+    # the binary changed, its version is probed again
+    program.version_output = None
+    stat = os.stat(program.cmd)
+    os.utime(program.cmd, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    await camisole.versions.probe_all(path)
+    assert runs(program) == 2
+
+
+@pytest.mark.asyncio
+async def test_unreadable_snapshot(program, tmp_path):
+    path = tmp_path / 'versions.json'
+    path.write_text('{nope')
+    await camisole.versions.probe_all(path)
+    assert program.version() == '1.2.3'
+    assert camisole.versions.load_snapshot(path)